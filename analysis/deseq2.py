@@ -3,26 +3,34 @@
 #
 #  All analysis related to DESeq2 output
 
-import re
+import os
 
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import pygraphviz as pgv
-from SecretColors import Palette
-from SecretColors.utils import text_color
-from gprofiler import GProfiler
-from matplotlib.patches import Patch
 
-matplotlib.rc("font", family="IBM Plex Sans")
-
-p = Palette()
+from analysis.enrichment import GProfilerBackend
+from analysis.store import EnrichmentStore
+from analysis.terms import TermGraph
+from helpers.plotting import FONT, palette, pyplot
+from helpers.trace import traced
 
 SOURCE_NODES = ["GO:0005575", "KEGG:00000", "GO:0008150", "GO:0003674"]
 
 
-def go_enrichment_analysis(filename: str):
+@traced
+def go_enrichment_analysis(filename: str, backend=None, contrast=None,
+                           store=None, output=None):
+    """
+    Enrichment of up- and down-regulated genes (padj < 0.05)
+
+    :param filename: Output file generated by DESeq2
+    :param backend: analysis.enrichment.LocalBackend or GProfilerBackend
+    (default, responses are cached on the disk)
+    :param contrast: Name under which results are stored (default: name
+    of the DESeq2 file)
+    :param store: EnrichmentStore (default: ENRICHMENT_STORE folder)
+    :param output: Optional CSV file where results are saved as well
+    """
     df = pd.read_csv(filename)
     df = df[df["padj"] < 0.05]
     df = df.sort_values(by="log2FoldChange", ascending=False)
@@ -31,88 +39,80 @@ def go_enrichment_analysis(filename: str):
     # those are more significant
     df = df.sort_values(by="log2FoldChange", ascending=True)
     down_genes = df[df["log2FoldChange"] < 0]["gene_id"].to_numpy()
-    gp = GProfiler(return_dataframe=True)
-    prof = gp.profile(organism="drerio",
-                      ordered=True,
-                      no_evidences=True,
-                      query={
-                          "up": list(up_genes),
-                          "down": list(down_genes)
-                      },
-                      domain_scope="known",
-                      user_threshold=0.05)
-    prof.to_csv("out.csv", index=False)
+    if backend is None:
+        backend = GProfilerBackend()
+    prof = backend.profile({
+        "up": list(up_genes),
+        "down": list(down_genes)
+    }, threshold=0.05)
+    if contrast is None:
+        contrast = os.path.splitext(os.path.basename(filename))[0]
+    if store is None:
+        store = EnrichmentStore()
+    store.write(prof, contrast)
+    if output is not None:
+        prof.to_csv(output, index=False)
+    return prof
 
 
 # 'source', 'native', 'name', 'p_value', 'significant', 'description',
 #        'term_size', 'query_size', 'intersection_size', 'effective_domain_size',
 #        'precision', 'recall', 'query', 'parents'
 
-def draw_network(source):
-    df = pd.read_csv("out.csv", encoding="utf8")
+def draw_network(source, contrast, store=None, output="plot.png"):
+    import pygraphviz as pgv
+    from SecretColors.utils import text_color
+    p = palette()
+    store = store or EnrichmentStore()
+    df = store.query(contrast=contrast, source=source, max_p=0.05)
     df = df[df["p_value"] < 0.05]
-    df = df.sort_values(by="p_value")
-    df = df[df["source"] == source]
     df["p_value"] = -1 * np.log(df["p_value"])
     # df["p_value"] = np.log(df["p_value"])
     max_p = df["p_value"].max()
     # df["p_value"] = 20 + df["p_value"] * 50 / max_p
     df["p_value"] = df["p_value"] / max_p
 
-    colors = dict(zip(df['native'], df["p_value"]))
-
-    name_maps = {}
-    # Add all children in given order
-    counter = 1
-
-    for c in df["native"].values:
-        if c not in name_maps:
-            name_maps[c] = counter
-            counter += 1
+    terms = TermGraph.from_results(df)
+    colors = np.full(len(terms), np.nan)
+    colors[terms.position(df["native"])] = df["p_value"].to_numpy()
 
     graph = pgv.AGraph(directed=True)
-    for (i, d) in df.iterrows():
-        parents = d["parents"]
-        parents = [re.sub("[^A-Za-z0-9:]+", "", x) for x in parents.split(",")]
-        parents = [x for x in parents if len(x) > 0]
-        child = d["native"]
-
-        for k in parents:
-            if k not in name_maps.keys():
-                name_maps[k] = counter
-                counter += 1
-            graph.add_edge(name_maps[k], name_maps[child])
-
-    id_mapping = {v: k for k, v in name_maps.items()}
+    parent, child = terms.edges()
+    graph.add_edges_from(zip((parent + 1).tolist(), (child + 1).tolist()))
+
     graph.graph_attr['dpi'] = 300
     graph.graph_attr['bgcolor'] = "transparent"
     graph.graph_attr['overlap'] = False
     for n in graph.nodes():
         n.attr['style'] = "filled"
         n.attr['color'] = p.gray(shade=20)
-        name = id_mapping[int(n.name)]
-        if name in colors:
-            clr = 15 + colors[name] * 70
+        value = colors[int(n.name) - 1]
+        if not np.isnan(value):
+            clr = 15 + value * 70
             clr = p.red(shade=clr)
             n.attr['color'] = clr
             n.attr['fontcolor'] = text_color(clr)
             n.attr['fontsize'] = 18
 
     graph.layout()
-    graph.draw("plot.png")
+    graph.draw(output)
 
 
-def map_terms(no_of_terms, source, condition, axis_offset=50):
+def map_terms(no_of_terms, source, condition, contrast, axis_offset=50,
+              store=None, output="plot.png"):
+    from matplotlib.patches import Patch
+    plt = pyplot(FONT)
+    p = palette()
     # plt.figure(figsize=(9, 5))
     plt.figure(figsize=(7, 5))
     up_color = p.blue
     down_color = p.red
-    df = pd.read_csv("out.csv")
+    store = store or EnrichmentStore()
     # Remove the base node
-    df = df[~df["native"].isin(SOURCE_NODES)]
-    df = df.sort_values(by="p_value")
+    df = store.query(contrast=contrast, source=source, top=no_of_terms,
+                     exclude=SOURCE_NODES,
+                     columns=["name", "native", "p_value"])
     df["p_value"] = np.log(df["p_value"])
-    df = df[df["source"] == source]
     upr = df[df["query"] == "up"]
     up_mapping = tuple(zip(upr["name"], upr["p_value"]))
     up_mapping = sorted(up_mapping, key=lambda x: x[1])
@@ -151,55 +151,58 @@ def map_terms(no_of_terms, source, condition, axis_offset=50):
                  va="bottom",
                  xycoords="axes fraction")
     plt.gca().invert_yaxis()
-    plt.savefig("plot.png", dpi=300, transparent=True)
+    plt.savefig(output, dpi=300, transparent=True)
     plt.show()
-
-
-def plot_network(source):
-    df = pd.read_csv("out.csv")
+    plt.close()
+
+
+def plot_network(source, contrast, top=None, store=None,
+                 output="plot.png"):
+    """
+    Network of enriched terms colored by the query they are enriched in
+
+    :param source: Source of the terms (e.g. GO:BP, KEGG)
+    :param contrast: Contrast in the EnrichmentStore
+    :param top: If given, only this many most significant terms and their
+    ancestors are drawn
+    :param store: EnrichmentStore (default: ENRICHMENT_STORE folder)
+    :param output: Output image file
+    """
+    import pygraphviz as pgv
+    p = palette()
+    store = store or EnrichmentStore()
+    df = store.query(contrast=contrast, source=source, max_p=0.05,
+                     exclude=SOURCE_NODES)
     df = df[df["p_value"] < 0.05]
-    df = df[df["source"] == source]
-    df = df.sort_values(by="p_value")
-    df = df[~df["native"].isin(SOURCE_NODES)]
-    up = df[df["query"] == "up"]
-    down = df[df["query"] == "down"]
-    counter = 1
-    names = {}
-    for it in df["native"].values:
-        if it not in names:
-            names[it] = counter
-            counter += 1
+    terms = TermGraph.from_results(df)
+    cond_up = terms.mask(df[df["query"] == "up"]["native"])
+    cond_down = terms.mask(df[df["query"] == "down"]["native"])
 
+    nodes = None
+    if top is not None:
+        nodes = terms.ancestors(pd.unique(df["native"])[:top])
     graph = pgv.AGraph(directed=True)
-    for _, d in df.iterrows():
-        parents = d["parents"]
-        parents = [re.sub("[^A-Za-z0-9:]+", "", x) for x in parents.split(",")]
-        for k in parents:
-            if k not in names:
-                names[k] = counter
-                counter += 1
-            graph.add_edge(names[k], names[d["native"]])
-
-    for n in names:
-        cond_up = n in up['native'].values
-        cond_down = n in down['native'].values
-        nd = graph.get_node(names[n])
-        if any([cond_up, cond_down]):
+    parent, child = terms.edges(nodes)
+    graph.add_edges_from(zip((parent + 1).tolist(), (child + 1).tolist()))
+
+    colors = np.full(len(terms), None, dtype=object)
+    colors[cond_up] = p.blue(shade=40)
+    colors[cond_down] = p.red(shade=40)
+    colors[cond_up & cond_down] = p.gray()
+    for nd in graph.nodes():
+        i = int(nd.name) - 1
+        if colors[i] is not None:
             nd.attr['style'] = "filled"
-        if all([cond_up, cond_down]):
-            nd.attr['color'] = p.gray()
-        elif cond_up:
-            nd.attr['color'] = p.blue(shade=40)
-        elif cond_down:
-            nd.attr['color'] = p.red(shade=40)
+            nd.attr['color'] = colors[i]
 
     graph.graph_attr['overlap'] = False
     graph.graph_attr['K'] = 10
     graph.layout("sfdp")
-    graph.draw("plot.png")
+    graph.draw(output)
 
 
 def run():
     source = "KEGG"
     # go_enrichment_analysis("deseq2/salmon_hsf_vs_whole.csv")
-    map_terms(10, source, "HSF/W (WT)", axis_offset=10)
+    map_terms(10, source, "HSF/W (WT)", "salmon_hsf_vs_whole",
+              axis_offset=10)
@@ -0,0 +1,216 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Functional enrichment with local annotations or (cached) g:Profiler
+
+import os
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from helpers.cache import atomic_write, content_key
+from helpers.constants import CACHE_FOLDER
+from helpers.stats import adjust_pvalues
+from helpers.trace import traced
+
+# Same columns as returned by g:Profiler, so that the rest of the
+# analysis does not depend on the backend
+RESULT_COLUMNS = ['source', 'native', 'name', 'p_value', 'significant',
+                  'description', 'term_size', 'query_size',
+                  'intersection_size', 'effective_domain_size', 'precision',
+                  'recall', 'query', 'parents']
+
+GAF_ASPECTS = {"P": "GO:BP", "F": "GO:MF", "C": "GO:CC"}
+
+
+class GeneSetLibrary:
+    """
+    Annotation terms stored as a sparse (terms x genes) boolean matrix.
+
+    :param terms: list of (source, term ID, name, genes)
+    :param parents: Optional dict of term ID -> list of parent term IDs
+    """
+
+    def __init__(self, terms: list, parents=None):
+        from scipy import sparse
+        self.sources = np.asarray([x[0] for x in terms], dtype=str)
+        self.native = np.asarray([x[1] for x in terms], dtype=str)
+        self.names = np.asarray([x[2] for x in terms], dtype=str)
+        self.parents = parents or {}
+        self.genes = np.unique(np.concatenate(
+            [np.asarray(list(x[3]), dtype=str) for x in terms] +
+            [np.zeros(0, dtype=str)]))
+        rows, cols = [], []
+        for i, t in enumerate(terms):
+            idx = np.searchsorted(self.genes, np.unique(
+                np.asarray(list(t[3]), dtype=str)))
+            rows.append(np.full(len(idx), i))
+            cols.append(idx)
+        rows = np.concatenate(rows + [np.zeros(0, dtype=int)])
+        cols = np.concatenate(cols + [np.zeros(0, dtype=int)])
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+            shape=(len(terms), len(self.genes)))
+
+    def __len__(self):
+        return len(self.native)
+
+    def indicator(self, genes) -> np.ndarray:
+        """Boolean vector over library genes"""
+        genes = np.asarray(list(genes), dtype=str)
+        return np.isin(self.genes, genes)
+
+    @classmethod
+    def from_gmt(cls, filename: str, source=None):
+        """
+        GMT file: term ID, description and genes separated by tabs. If
+        source is not given, prefix of the term ID (e.g. 'KEGG') is used.
+        """
+        terms = []
+        with open(filename) as f:
+            for line in f:
+                items = line.rstrip("\n").split("\t")
+                if len(items) < 3:
+                    continue
+                src = source or items[0].split(":")[0]
+                terms.append((src, items[0], items[1],
+                              [x for x in items[2:] if x]))
+        return cls(terms)
+
+    @classmethod
+    def from_gaf(cls, filename: str, gene_column=1, names=None,
+                 parents=None):
+        """
+        GO annotation (GAF 2.x) file. NOT qualified annotations are
+        ignored.
+
+        :param gene_column: 0 based column used as gene ID (1 is the DB
+        object ID, 2 the symbol)
+        :param names: Optional dict of GO ID -> term name
+        :param parents: Optional dict of GO ID -> parent GO IDs
+        """
+        genes = defaultdict(set)
+        with open(filename) as f:
+            for line in f:
+                if line.startswith("!"):
+                    continue
+                items = line.rstrip("\n").split("\t")
+                if len(items) < 9 or "NOT" in items[3]:
+                    continue
+                genes[(GAF_ASPECTS.get(items[8], "GO"), items[4])].add(
+                    items[gene_column])
+        names = names or {}
+        terms = [(s, t, names.get(t, t), g) for (s, t), g in genes.items()]
+        return cls(terms, parents=parents)
+
+
+@traced
+def hypergeometric_enrichment(query: dict, library: GeneSetLibrary,
+                              universe=None, threshold=0.05,
+                              correction="fdr") -> pd.DataFrame:
+    """
+    One-sided hypergeometric test of all terms for all queries at once.
+
+    :param query: dict of query name -> gene IDs
+    :param library: GeneSetLibrary
+    :param universe: Genes considered as background (default: all
+    annotated genes, like g:Profiler's 'known' domain scope)
+    :param threshold: Significance threshold after correction
+    :param correction: 'fdr' (Benjamini-Hochberg) or 'bonferroni'
+    :return: DataFrame with the same columns as g:Profiler
+    """
+    from scipy.stats import hypergeom
+    domain = np.ones(len(library.genes), dtype=bool)
+    if universe is not None:
+        domain = library.indicator(universe)
+    matrix = library.matrix.multiply(domain[None, :]).tocsr()
+    term_size = np.asarray(matrix.sum(axis=1)).ravel()
+    n_domain = int(domain.sum())
+
+    frames = []
+    for name, genes in query.items():
+        q = library.indicator(genes) & domain
+        query_size = int(q.sum())
+        overlap = np.asarray(matrix @ q.astype(np.int32)).ravel()
+        keep = overlap > 0
+        pvalues = hypergeom.sf(overlap[keep] - 1, n_domain,
+                               term_size[keep], query_size)
+        if correction == "bonferroni":
+            adjusted = np.minimum(pvalues * len(library), 1)
+        else:
+            adjusted = adjust_pvalues(pvalues)
+        native = library.native[keep]
+        frames.append(pd.DataFrame({
+            "source": library.sources[keep],
+            "native": native,
+            "name": library.names[keep],
+            "p_value": adjusted,
+            "significant": adjusted <= threshold,
+            "description": library.names[keep],
+            "term_size": term_size[keep],
+            "query_size": query_size,
+            "intersection_size": overlap[keep],
+            "effective_domain_size": n_domain,
+            "precision": overlap[keep] / max(query_size, 1),
+            "recall": overlap[keep] / np.maximum(term_size[keep], 1),
+            "query": name,
+            "parents": [library.parents.get(x, []) for x in native],
+        }))
+    df = pd.concat(frames, ignore_index=True) if frames else \
+        pd.DataFrame(columns=RESULT_COLUMNS)
+    df = df[df["p_value"] <= threshold]
+    return df.sort_values(by=["query", "p_value"]).reset_index(drop=True)
+
+
+class LocalBackend:
+    """
+    Enrichment against local annotation (GMT / GAF files), works without
+    network access.
+    """
+
+    def __init__(self, library: GeneSetLibrary, universe=None,
+                 correction="fdr"):
+        self.library = library
+        self.universe = universe
+        self.correction = correction
+
+    def profile(self, query: dict, threshold=0.05) -> pd.DataFrame:
+        return hypergeometric_enrichment(query, self.library,
+                                         universe=self.universe,
+                                         threshold=threshold,
+                                         correction=self.correction)
+
+
+class GProfilerBackend:
+    """
+    g:Profiler web service. Responses are stored on disk, keyed on the
+    query and all parameters, so the same query is sent only once.
+    """
+
+    def __init__(self, organism="drerio", cache_folder=None):
+        self.organism = organism
+        self.cache_folder = cache_folder or f"{CACHE_FOLDER}/gprofiler"
+
+    def profile(self, query: dict, threshold=0.05) -> pd.DataFrame:
+        params = dict(organism=self.organism,
+                      ordered=True,
+                      no_evidences=True,
+                      domain_scope="known",
+                      user_threshold=threshold)
+        query = {k: [str(x) for x in v] for k, v in query.items()}
+        key = content_key(params, query)
+        filename = f"{self.cache_folder}/{key}.pkl"
+        if os.path.isfile(filename):
+            return pd.read_pickle(filename)
+
+        from gprofiler import GProfiler
+        gp = GProfiler(return_dataframe=True)
+        prof = gp.profile(query=query, **params)
+        if not os.path.isdir(self.cache_folder):
+            os.makedirs(self.cache_folder)
+        with atomic_write(filename) as tmp:
+            prof.to_pickle(tmp)
+        return prof
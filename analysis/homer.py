@@ -5,10 +5,25 @@
 #  Homer de-novo motif predictions
 
 import os
-import subprocess
 
+from helpers.constants import HOMER_PATH
+from helpers.jobs import Job, run_jobs
+from helpers.trace import traced
 
-def run_homer():
+
+@traced
+def run_homer(cpus=None, threads=7, timeout=None, retries=1,
+              tool_path=None):
+    """
+    Runs HOMER on all targets, concurrently within the CPU budget (see
+    helpers.jobs.run_jobs)
+
+    :param cpus: CPU budget for all HOMER runs together
+    :param threads: Threads given to each HOMER run (-p)
+    :param timeout: Timeout (in seconds) of a single HOMER run
+    :param retries: Number of retries of failed run
+    :param tool_path: Folders with HOMER binaries (default: HOMER_PATH)
+    """
     folder = "homer"
     if not os.path.isdir(folder):
         os.mkdir(folder)
@@ -26,10 +41,11 @@ def run_homer():
         for p in prefix:
             targets.append(f"{p}{t}")
 
-    homer_path = ":/home/dex/Softwares/homer/bin"
+    homer_path = "".join(f":{x}" for x in (tool_path or HOMER_PATH))
     env = os.environ.copy()
     env['PATH'] += homer_path
 
+    jobs = []
     for target in targets:
         output = target.replace("_3utr.fasta", "")
         output = f"{folder}/{output}"
@@ -42,13 +58,18 @@ def run_homer():
             '-rna',
             '-homer2',
             "-p",
-            "7",
+            str(threads),
         ]
         all_opts = [x for x in random_opts]
         all_opts[3] = f"{output}_all"
         all_opts.extend(["-fasta", control])
-        subprocess.run(random_opts, env=env)
-        subprocess.run(all_opts, env=env)
+        name = os.path.basename(output)
+        for opts, suffix in [(random_opts, "control"), (all_opts, "all")]:
+            jobs.append(Job(f"homer_{name}_{suffix}", opts, env=env,
+                            threads=threads,
+                            complete=f"{output}_{suffix}/homerResults",
+                            timeout=timeout, retries=retries))
+    return run_jobs(jobs, cpus=cpus)
 
 
 def run():
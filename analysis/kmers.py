@@ -0,0 +1,119 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Quick k-mer enrichment screen before running STREME / HOMER
+
+import numpy as np
+import pandas as pd
+
+from helpers.fasta import header_field, iter_fasta
+from helpers.packed import BASES, PackedSequences
+from helpers.stats import adjust_pvalues
+from helpers.trace import traced
+
+
+def load_fasta(filename: str) -> PackedSequences:
+    """
+    Packs the FASTA file (e.g. generated by meme.prepare_fasta). Full
+    header is used as an ID.
+    """
+    return PackedSequences.from_records(
+        iter_fasta(filename, header=header_field(None)))
+
+
+def decode_kmers(codes: np.ndarray, k: int) -> np.ndarray:
+    """Converts integer encoded k-mers back to strings"""
+    codes = np.asarray(codes, dtype=np.uint64)
+    shifts = np.arange(2 * (k - 1), -1, -2, dtype=np.uint64)
+    digits = (codes[:, None] >> shifts) & np.uint64(3)
+    letters = np.frombuffer(BASES.encode(), dtype=np.uint8)[digits]
+    return letters.view(f"S{k}").ravel().astype(str)
+
+
+def count_kmers(seqs: PackedSequences, k: int):
+    """
+    Counts in how many sequences each k-mer is present (multiple
+    occurrences within a sequence are counted once, as STREME does).
+
+    :param seqs: Packed sequences
+    :param k: k-mer length
+    :return: (sorted k-mer codes, number of sequences containing them)
+    """
+    present = [np.unique(x) for x in seqs.iter_kmers(k)]
+    present = [x for x in present if len(x) > 0]
+    if len(present) == 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+    return np.unique(np.concatenate(present), return_counts=True)
+
+
+@traced
+def kmer_enrichment(target: PackedSequences, control: PackedSequences,
+                    k: int) -> pd.DataFrame:
+    """
+    One-sided Fisher's exact test (hypergeometric tail) of every k-mer
+    present in the target sequences against the control sequences.
+
+    :return: DataFrame ranked by p-value
+    """
+    from scipy.stats import hypergeom
+    t_codes, t_counts = count_kmers(target, k)
+    c_codes, c_counts = count_kmers(control, k)
+    n_t, n_c = len(target), len(control)
+
+    b = np.zeros(len(t_codes), dtype=np.int64)
+    if len(c_codes) > 0:
+        pos = np.searchsorted(c_codes, t_codes)
+        pos[pos == len(c_codes)] = 0
+        found = c_codes[pos] == t_codes
+        b[found] = c_counts[pos[found]]
+
+    pvalues = hypergeom.sf(t_counts - 1, n_t + n_c, t_counts + b, n_t)
+    t_frac = t_counts / max(n_t, 1)
+    c_frac = b / max(n_c, 1)
+    df = pd.DataFrame({
+        "kmer": decode_kmers(t_codes, k),
+        "k": k,
+        "target": t_counts,
+        "control": b,
+        "target_fraction": t_frac,
+        "control_fraction": c_frac,
+        # Pseudo-count to keep k-mers absent from control finite
+        "enrichment": ((t_counts + 0.5) / (n_t + 1)) /
+                      ((b + 0.5) / (n_c + 1)),
+        "p_value": pvalues,
+        "q_value": adjust_pvalues(pvalues),
+    })
+    return df.sort_values(by="p_value", kind="mergesort").reset_index(
+        drop=True)
+
+
+@traced
+def screen(primary: str, control: str, min_k=6, max_k=12) -> pd.DataFrame:
+    """
+    Runs the k-mer enrichment for all k between min_k and max_k (same as
+    STREME's --minw and --maxw used in meme.run_streme)
+
+    :param primary: Target FASTA file
+    :param control: Control FASTA file
+    :return: Ranked table of all k-mers
+    """
+    target = load_fasta(primary)
+    background = load_fasta(control)
+    tables = [kmer_enrichment(target, background, k)
+              for k in range(min_k, max_k + 1)]
+    df = pd.concat(tables, ignore_index=True)
+    return df.sort_values(by="p_value", kind="mergesort").reset_index(
+        drop=True)
+
+
+def is_informative(primary: str, control: str, min_k=6, max_k=12,
+                   q_value=0.05) -> bool:
+    """
+    True if at least one k-mer is enriched in primary sequences below
+    given FDR. Gene sets without any such k-mer are unlikely to give
+    significant de-novo motifs.
+    """
+    df = screen(primary, control, min_k=min_k, max_k=max_k)
+    return bool((df["q_value"] <= q_value).any())
@@ -6,33 +6,40 @@
 #  All functions which prepare files for the meme analysis
 
 import os
-import subprocess
 
-import pandas as pd
-
-from helpers.common import extract_utr_sequence, get_genes
-from helpers.constants import *
+from analysis.kmers import is_informative
+from helpers.common import get_genes, iter_utr_sequence
+from helpers.constants import MEME_PATH
+from helpers.context import COL_TRANSCRIPT, get_context
+from helpers.jobs import Job, run_jobs
+from helpers.trace import traced
 
 
+@traced(count=lambda x: None)
 def prepare_fasta(utr, genes, filename=None):
-    t2g = pd.read_csv(FILE_MAPPING)
-    t2g = dict(zip(t2g["Transcript stable ID"], t2g["Gene stable ID"]))
-    seqs = extract_utr_sequence(utr)
-    if genes is None:
-        seqs = {t2g[k]: v for k, v in seqs.items()}
-    else:
-        seqs = {t2g[k]: v for k, v in seqs.items() if t2g[k] in genes}
+    """
+    Writes one UTR sequence per gene: UTR of its longest transcript, same
+    as in the length plots (see UTRContext.longest). Only sequences of at
+    least 6 bases are written.
+    """
+    ctx = get_context()
+    t2g = ctx.t2g
+    df = ctx.longest(utr)
+    if genes is not None:
+        df = df[df.index.isin(genes)]
+    chosen = set(df[COL_TRANSCRIPT])
     if filename is None:
         filename = f"{utr}utr.fasta"
     with open(filename, "w") as f:
-        for k, v in seqs.items():
-            if len(v) >= 6:
-                print(f">{k}", file=f)
+        for k, v in iter_utr_sequence(utr):
+            if k in chosen and len(v) >= 6:
+                print(f">{t2g[k]}", file=f)
                 print(v, file=f)
 
     return filename
 
 
+@traced
 def generate_all():
     folder = "fasta"
     if not os.path.isdir(folder):
@@ -49,12 +56,24 @@ def generate_all():
         prepare_fasta(3, genes, filename=filename)
 
 
-def run_streme():
+@traced
+def run_streme(prescreen=False, cpus=None, timeout=None, retries=1,
+               tool_path=None):
+    """
+    Runs STREME for every target against shuffled and control sequences.
+    All runs are scheduled concurrently (see helpers.jobs.run_jobs).
+
+    :param prescreen: If True, targets without any enriched k-mer (see
+    analysis.kmers.is_informative) are skipped
+    :param cpus: CPU budget for all STREME runs together
+    :param timeout: Timeout (in seconds) of a single STREME run
+    :param retries: Number of retries of failed run
+    :param tool_path: Folders with STREME binaries (default: MEME_PATH)
+    """
     folder = "streme"
     if not os.path.isdir(folder):
         os.mkdir(folder)
-    meme_path = ":/home/dex/Softwares/meme/bin"
-    meme_path += ":/home/dex/Softwares/meme/libexec/meme-5.2.0"
+    meme_path = "".join(f":{x}" for x in (tool_path or MEME_PATH))
     targets = [
         "down_mitocarta_mars_mia40_3utr.fasta",
         "down_mitocarta_mars_wt_3utr.fasta",
@@ -64,10 +83,14 @@ def run_streme():
     control = "./fasta/control.fasta"
     env = os.environ.copy()
     env['PATH'] += meme_path
+    jobs = []
     for i in range(len(targets)):
         name = targets[i].replace("_3utr.fasta", '')
         output_path = f"./{folder}/{name}"
         primary = f"./fasta/{targets[i]}"
+        if prescreen and not is_informative(primary, control, 6, 12):
+            print(f"Skipped {primary} : no enriched k-mers")
+            continue
 
         opts_random = [
             "streme",
@@ -87,9 +110,11 @@ def run_streme():
         ])
         opts_all.extend(["--p", primary])
         opts_random.extend(["--p", primary])
-        # For random
-        subprocess.run(opts_random, env=env)
-        subprocess.run(opts_all, env=env)
+        for opts, suffix in [(opts_random, "control"), (opts_all, "all")]:
+            jobs.append(Job(f"streme_{name}_{suffix}", opts, env=env,
+                            complete=f"{output_path}_{suffix}/streme.txt",
+                            timeout=timeout, retries=retries))
+    return run_jobs(jobs, cpus=cpus)
 
 
 def extract_motifs(folder):
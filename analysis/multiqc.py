@@ -7,25 +7,28 @@
 
 from collections import defaultdict
 
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from SecretColors import Palette
-from SecretColors.cmaps import BrewerMap
-from matplotlib.patches import Patch
 
-p = Palette()
-
-color_list = [p.red(), p.red(shade=20), p.blue(shade=40)]
-cm = BrewerMap(matplotlib).from_list(color_list, is_qualitative=True)
+from helpers.plotting import palette, pyplot, setup_matplotlib
 
 FILE_FASTQC = "multiqcdata/fastqc-status-check-heatmap.csv"
 FILE_SORTMERNA = "multiqcdata/sortmerna-detailed-plot.csv"
 FILE_STAR = "multiqcdata/star_alignment_plot.csv"
 
 
-def plot_fastqc():
+def status_colormap():
+    """Colormap of the FastQC status (fail, warn, pass)"""
+    from SecretColors.cmaps import BrewerMap
+    p = palette()
+    color_list = [p.red(), p.red(shade=20), p.blue(shade=40)]
+    return BrewerMap(setup_matplotlib()).from_list(color_list,
+                                                   is_qualitative=True)
+
+
+def plot_fastqc(output="plot.png"):
+    plt = pyplot()
+    p = palette()
     df = pd.read_csv(FILE_FASTQC)
     analysis_type = df["Section Name"].values
     samples = df["Series 1 (y)"].values
@@ -48,7 +51,7 @@ def plot_fastqc():
     fig = plt.figure(figsize=(14, 8))  # type: plt.Figure
     ax = fig.add_subplot()  # type: plt.Axes
     full_data = np.asarray(full_data).transpose()
-    ax.imshow(full_data, cmap=cm, aspect='auto')
+    ax.imshow(full_data, cmap=status_colormap(), aspect='auto')
     ax.set_yticks(range(0, len(labels)))
     ax.set_yticklabels(labels)
     x_labels = ["\n".join(str(x).strip().rsplit(" ", 2)) for x in x_labels]
@@ -61,11 +64,15 @@ def plot_fastqc():
         if i % 3 == 0:
             ax.axhline(i - 0.5, color=p.white(), alpha=0.8, ls="--")
     plt.tight_layout()
-    plt.savefig("plot.png", dpi=300, transparent=True)
+    plt.savefig(output, dpi=300, transparent=True)
     plt.show()
+    plt.close()
 
 
-def plot_sortmerna():
+def plot_sortmerna(output="plot.png"):
+    from matplotlib.patches import Patch
+    plt = pyplot()
+    p = palette()
     c1 = "silva-euk-18s-id95_count"
     c2 = "silva-euk-28s-id98_count"
     df = pd.read_csv(FILE_SORTMERNA)
@@ -92,11 +99,15 @@ def plot_sortmerna():
 
     plt.legend(handles=handles, loc=0)
     plt.tight_layout()
-    plt.savefig("plot.png", dpi=300, transparent=True)
+    plt.savefig(output, dpi=300, transparent=True)
     plt.show()
+    plt.close()
 
 
-def plot_star():
+def plot_star(output="plot.png"):
+    from matplotlib.patches import Patch
+    plt = pyplot()
+    p = palette()
     df = pd.read_csv(FILE_STAR)
     df = df.sort_values(by="Category", ascending=False)
     c1 = "Uniquely mapped"
@@ -134,8 +145,9 @@ def plot_star():
     plt.grid(axis="x", color=p.black(), alpha=0.5, ls="--")
     plt.xlabel("Reads (in Millions)")
     plt.tight_layout()
-    plt.savefig("plot.png", dpi=300, transparent=True)
+    plt.savefig(output, dpi=300, transparent=True)
     plt.show()
+    plt.close()
 
 
 def run():
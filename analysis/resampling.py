@@ -0,0 +1,228 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Permutation and resampling tests for UTR length comparisons
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from helpers.trace import traced
+
+CHUNK_ELEMENTS = 5_000_000  # Max. elements of one index / mask matrix
+
+
+def _chunks(n, width):
+    rows = max(1, CHUNK_ELEMENTS // max(width, 1))
+    for start in range(0, n, rows):
+        yield min(rows, n - start)
+
+
+def _shards(n, workers, seed):
+    """Splits n resamples into independent, reproducible shards"""
+    workers = max(1, workers)
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    sizes = [n // workers + (1 if i < n % workers else 0)
+             for i in range(workers)]
+    return [(s, q) for s, q in zip(sizes, seeds) if s > 0]
+
+
+def _run_sharded(func, args, n, seed, workers):
+    shards = _shards(n, workers or 1, seed)
+    if workers is None or workers <= 1:
+        parts = [func(*args, s, q) for s, q in shards]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(func, *zip(*[(*args, s, q)
+                                               for s, q in shards])))
+    return {k: np.concatenate([x[k] for x in parts]) for k in parts[0]}
+
+
+def _ks(order_values, membership: np.ndarray, n_a: int,
+        n_b: int) -> np.ndarray:
+    """
+    KS statistic for every row of the membership matrix (True for group
+    A) given in order of sorted pooled values. CDFs are compared only
+    after the last of tied values, so order within ties does not matter.
+    """
+    last = np.r_[order_values[1:] != order_values[:-1], True]
+    cum_a = np.cumsum(membership, axis=1)[:, last] / n_a
+    cum_b = np.cumsum(~membership, axis=1)[:, last] / n_b
+    return np.abs(cum_a - cum_b).max(axis=1)
+
+
+def _statistics(order_values, ranks, membership, n_a, n_b):
+    """Median difference, Mann-Whitney U and KS for every row"""
+    values = np.broadcast_to(order_values, membership.shape)
+    a = np.where(membership, values, np.nan)
+    b = np.where(membership, np.nan, values)
+    median = np.nanmedian(a, axis=1) - np.nanmedian(b, axis=1)
+    u = (membership * ranks).sum(axis=1) - n_a * (n_a + 1) / 2
+    ks = _ks(order_values, membership, n_a, n_b)
+    return {"median": median, "u": u, "ks": ks}
+
+
+def _permutation_shard(pooled, n_a, n, seed):
+    from scipy.stats import rankdata
+    rng = np.random.default_rng(seed)
+    order = np.argsort(pooled, kind="mergesort")
+    values = pooled[order]
+    ranks = rankdata(values)
+    n_b = len(pooled) - n_a
+    results = []
+    for rows in _chunks(n, len(pooled)):
+        # Random labels: first n_a positions of every permutation are A
+        perm = rng.random((rows, len(pooled))).argsort(axis=1)
+        membership = perm < n_a
+        results.append(_statistics(values, ranks, membership, n_a, n_b))
+    return {k: np.concatenate([x[k] for x in results]) for k in
+            results[0]}
+
+
+def _empirical(observed: float, null: np.ndarray, center: float) -> float:
+    """Two-sided empirical p-value with the +1 correction"""
+    extreme = np.abs(null - center) >= abs(observed - center) - 1e-12
+    return float((extreme.sum() + 1) / (len(null) + 1))
+
+
+@traced(count=lambda x: x["permutations"])
+def permutation_test(a, b, n=10000, seed=0, workers=None) -> dict:
+    """
+    Label permutation test between two sets of values (e.g. UTR lengths
+    of two conditions). All permutations are drawn as one index matrix
+    (in chunks) and statistics are computed in batch.
+
+    :param a: Values of the first group
+    :param b: Values of the second group
+    :param n: Number of permutations
+    :param seed: Seed of the random generator
+    :param workers: Number of processes (permutations are sharded with
+    independent seeds, so results depend only on seed and workers)
+    :return: dict with observed statistics, their empirical p-values and
+    effect sizes
+    """
+    from scipy.stats import rankdata
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    pooled = np.concatenate([a, b])
+    n_a, n_b = len(a), len(b)
+
+    order = np.argsort(pooled, kind="mergesort")
+    membership = (order < n_a)[None, :]
+    observed = _statistics(pooled[order], rankdata(pooled[order]),
+                           membership, n_a, n_b)
+    observed = {k: float(v[0]) for k, v in observed.items()}
+    null = _run_sharded(_permutation_shard, (pooled, n_a), n, seed,
+                        workers)
+    return {
+        "median_difference": observed["median"],
+        "p_median": _empirical(observed["median"], null["median"], 0),
+        "u": observed["u"],
+        # Common language effect size P(A > B)
+        "auc": observed["u"] / (n_a * n_b),
+        "p_u": _empirical(observed["u"], null["u"], n_a * n_b / 2),
+        "ks": observed["ks"],
+        "p_ks": float((np.sum(null["ks"] >= observed["ks"] - 1e-12) + 1) /
+                      (n + 1)),
+        "permutations": n,
+    }
+
+
+def strata(covariate, bins=10) -> np.ndarray:
+    """Quantile bins of the covariate (e.g. expression, transcript length)"""
+    covariate = np.asarray(covariate, dtype=np.float64)
+    edges = np.unique(np.quantile(covariate, np.linspace(0, 1, bins + 1)))
+    return np.clip(np.searchsorted(edges, covariate, side="right") - 1, 0,
+                   max(len(edges) - 2, 0))
+
+
+def draw_sets(strata_labels, selected, n, rng) -> np.ndarray:
+    """
+    Random gene sets as an (n x set size) index matrix into the universe.
+    Every set has the same number of genes from every stratum as the
+    selected set.
+
+    :param strata_labels: Stratum of every gene of the universe
+    :param selected: Indices of the observed gene set in the universe
+    """
+    columns = []
+    for s, count in zip(*np.unique(strata_labels[selected],
+                                   return_counts=True)):
+        members = np.flatnonzero(strata_labels == s)
+        keys = rng.random((n, len(members)))
+        columns.append(members[np.argpartition(keys, count - 1,
+                                               axis=1)[:, :count]])
+    return np.concatenate(columns, axis=1)
+
+
+def _background_shard(values, strata_labels, selected, n, seed):
+    from scipy.stats import rankdata
+    rng = np.random.default_rng(seed)
+    order = np.argsort(values, kind="mergesort")
+    position = np.empty(len(values), dtype=np.int64)
+    position[order] = np.arange(len(values))
+    ranks = rankdata(values)
+    results = []
+    for rows in _chunks(n, len(values)):
+        idx = draw_sets(strata_labels, selected, rows, rng)
+        membership = np.zeros((rows, len(values)), dtype=bool)
+        np.put_along_axis(membership, position[idx], True, axis=1)
+        results.append(_statistics(values[order], ranks[order], membership,
+                                   len(selected),
+                                   len(values) - len(selected)))
+    return {k: np.concatenate([x[k] for x in results]) for k in
+            results[0]}
+
+
+@traced(count=lambda x: x["permutations"])
+def background_test(values, selected, n=10000, covariate=None, bins=10,
+                    seed=0, workers=None) -> dict:
+    """
+    Compares a gene set against random gene sets of the same size drawn
+    from the annotated universe, optionally matched on a covariate.
+
+    :param values: Value (e.g. UTR length) of every gene of the universe
+    :param selected: Indices (or boolean mask) of the gene set in the
+    universe
+    :param n: Number of random sets
+    :param covariate: Optional covariate of every gene (e.g. expression)
+    used for matching
+    :param bins: Number of quantile bins of the covariate
+    :param seed: Seed of the random generator
+    :param workers: Number of processes
+    :return: dict with observed statistics (set vs rest of the universe),
+    empirical p-values and effect sizes
+    """
+    from scipy.stats import rankdata
+    values = np.asarray(values, dtype=np.float64)
+    selected = np.asarray(selected)
+    if selected.dtype == bool:
+        selected = np.flatnonzero(selected)
+    labels = np.zeros(len(values), dtype=np.int64)
+    if covariate is not None:
+        labels = strata(covariate, bins=bins)
+
+    n_a, n_b = len(selected), len(values) - len(selected)
+    order = np.argsort(values, kind="mergesort")
+    mask = np.zeros(len(values), dtype=bool)
+    mask[selected] = True
+    observed = _statistics(values[order], rankdata(values[order]),
+                           mask[order][None, :], n_a, n_b)
+    observed = {k: float(v[0]) for k, v in observed.items()}
+    null = _run_sharded(_background_shard, (values, labels, selected), n,
+                        seed, workers)
+    return {
+        "median_difference": observed["median"],
+        "null_median_difference": float(np.median(null["median"])),
+        "p_median": _empirical(observed["median"], null["median"],
+                               float(np.median(null["median"]))),
+        "auc": observed["u"] / (n_a * n_b),
+        "p_u": _empirical(observed["u"], null["u"],
+                          float(np.median(null["u"]))),
+        "ks": observed["ks"],
+        "p_ks": float((np.sum(null["ks"] >= observed["ks"] - 1e-12) + 1) /
+                      (n + 1)),
+        "permutations": n,
+    }
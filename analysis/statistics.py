@@ -3,32 +3,41 @@
 #
 #  UTR Analysis and related statistics.
 
-import matplotlib
-import matplotlib.pyplot as plt
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd
-from SecretColors import Palette
-from matplotlib.collections import LineCollection
-from matplotlib.patches import Patch
-from scipy.cluster import hierarchy
-from scipy.cluster.hierarchy import dendrogram
-from sklearn.cluster import AgglomerativeClustering
-from sklearn.decomposition import PCA
-
-matplotlib.rc('font', family='IBM Plex Sans')
+
+from helpers.cache import atomic_write, content_key, file_hash
+from helpers.constants import CACHE_FOLDER
+from helpers.density import kde
+from helpers.plotting import FONT, palette, pyplot
+from helpers.trace import traced
+
 # matplotlib.rcParams['text.usetex'] = True
 
-p = Palette()
 BASE_FOLDER = "salmon_counts"
 CONDITIONS = ["wt_hsf", "wt_mars", "wt_whole"]
-COND_COLORS = [p.cyan(shade=50),
-               p.magenta(shade=50),
-               p.yellow(shade=30),
-               p.gray(shade=50),
-               p.blue(shade=30),
-               p.red(shade=30)]
 REPLICATES = 3
 BACKGROUND_GRAY = 10
+SUMMARY_RANGE = (-10, 10)  # Range of Log2FC in violin plots
+DESEQ2_SUMMARY = f"{CACHE_FOLDER}/deseq2_summary.json"
+
+_DISTANCES = {}
+
+
+def condition_colors() -> list:
+    """Color of every condition (and of dendrogram links)"""
+    p = palette()
+    return [p.cyan(shade=50),
+            p.magenta(shade=50),
+            p.yellow(shade=30),
+            p.gray(shade=50),
+            p.blue(shade=30),
+            p.red(shade=30)]
 
 
 def get_raw_files():
@@ -45,10 +54,60 @@ def get_raw_files():
     return all_samples
 
 
+def _read_quant(filename: str, col: str, name: str) -> pd.Series:
+    df = pd.read_csv(filename, sep="\t", usecols=[name, col],
+                     dtype={name: str, col: np.float32}, index_col=name)
+    return df[col]
+
+
+@traced(count=lambda x: len(x[0]))
+def load_expression(filenames: list, col="TPM", name="Name", workers=None,
+                    cache=True):
+    """
+    Loads given column of all quantification files in parallel and
+    aligns them on the sorted set of genes present in every file. The
+    resulting float32 matrix is cached as a .npy file (keyed on the
+    content of the input files) and memory-mapped on the next call.
+
+    :param filenames: Names of all the input files
+    :param col: Column to load ('TPM' or 'NumReads' for Salmon)
+    :param name: Column with gene / transcript names
+    :param workers: Number of threads used to read the files
+    :param cache: Use the on-disk cache in CACHE_FOLDER
+    :return: (gene names, genes x samples float32 array)
+    """
+    key = content_key(col, name, [(f, file_hash(f)) for f in filenames])
+    matrix_file = f"{CACHE_FOLDER}/expression_{key}.npy"
+    names_file = f"{CACHE_FOLDER}/expression_{key}_names.npy"
+    if cache and os.path.isfile(matrix_file) and os.path.isfile(names_file):
+        return (np.load(names_file, allow_pickle=False),
+                np.load(matrix_file, mmap_mode="r"))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        columns = list(pool.map(lambda x: _read_quant(x, col, name),
+                                filenames))
+    genes = np.unique(columns[0].index.to_numpy(dtype=str))
+    for c in columns[1:]:
+        genes = np.intersect1d(genes, c.index.to_numpy(dtype=str))
+    matrix = np.empty((len(genes), len(columns)), dtype=np.float32)
+    for i, c in enumerate(columns):
+        c = c[~c.index.duplicated()]
+        matrix[:, i] = c.reindex(genes).to_numpy(dtype=np.float32)
+
+    if cache:
+        os.makedirs(CACHE_FOLDER, exist_ok=True)
+        # Names are written last: their presence marks a complete cache
+        with atomic_write(matrix_file) as tmp:
+            np.save(tmp, matrix)
+        with atomic_write(names_file) as tmp:
+            np.save(tmp, genes)
+    return genes, matrix
+
+
 def extract_expression(filenames: list):
     """
     Takes all mapped file names (in this case for Salmon) as an input and
-    generates the pandas Dataframe where each column represent each sample
+    generates the array where each column represent each sample
     while reach rows represent gene. Each cell is TPM value calculated by
     your program for given combination.
 
@@ -62,34 +121,93 @@ def extract_expression(filenames: list):
     # Change this if not using Salmon output files
     col = "TPM"  # Name of column where TPM values are
     name = "Name"  # Name of column where your gene names are
-    all_dfs = []
-    for f in filenames:
-        df = pd.read_csv(f, sep="\t")
-        df = df.set_index(name)
-        df = df[[col]]
-        df = df.rename(columns={col: f})
-        all_dfs.append(df)
-    df = pd.concat(all_dfs, axis=1, join="inner")
-    return df.to_numpy()
+    return load_expression(filenames, col=col, name=name)[1]
+
+
+def _prepare_rows(tpms, rows, log):
+    data = np.asarray(tpms[rows], dtype=np.float32)
+    if log:
+        data = np.log2(data + 1)
+    return data
 
 
-def perform_pca(tpms):
+def _select_genes(tpms, log=False, top_variable=None, chunk_size=10000):
+    """
+    Row indices used for the PCA. With top_variable, only that many genes
+    with highest variance across samples are kept. Variance is calculated
+    chunk by chunk, so that memory-mapped matrices are not loaded fully.
+    """
+    n = tpms.shape[0]
+    if top_variable is None or top_variable >= n:
+        return np.arange(n)
+    var = np.empty(n, dtype=np.float32)
+    for start in range(0, n, chunk_size):
+        rows = np.arange(start, min(start + chunk_size, n))
+        var[rows] = _prepare_rows(tpms, rows, log).var(axis=1)
+    return np.sort(np.argsort(var)[::-1][:top_variable])
+
+
+@traced(count=lambda x: x[0].shape[1])
+def compute_pca(tpms, solver="full", n_components=2, log=False,
+                top_variable=None, chunk_size=10000):
+    """
+    PCA where genes are observations and samples are features (same as
+    earlier). Position of each sample on the components is returned.
+
+    :param tpms: TPM array where columns are each samples and rows are
+    genes. Can be memory-mapped (see load_expression).
+    :param solver: 'full' (all components), 'randomized' (randomized SVD
+    for top n_components) or 'incremental' (IncrementalPCA over row chunks)
+    :param n_components: Number of components ('full' computes all of them)
+    :param log: Use log2(TPM + 1)
+    :param top_variable: Keep only this many most variable genes
+    :param chunk_size: Rows per chunk for the 'incremental' solver
+    :return: (components x samples array, explained variance ratio)
+    """
+    from sklearn.decomposition import IncrementalPCA, PCA
+    rows = _select_genes(tpms, log=log, top_variable=top_variable,
+                         chunk_size=chunk_size)
+    if solver == "incremental":
+        pca = IncrementalPCA(n_components=n_components)
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            # Every partial fit needs at least n_components rows
+            if len(chunk) < n_components:
+                continue
+            pca.partial_fit(_prepare_rows(tpms, chunk, log))
+    elif solver == "randomized":
+        pca = PCA(n_components=n_components, svd_solver="randomized",
+                  random_state=0)
+        pca.fit(_prepare_rows(tpms, rows, log))
+    elif solver == "full":
+        pca = PCA()
+        pca.fit(_prepare_rows(tpms, rows, log))
+    else:
+        raise ValueError(f"Unknown PCA solver '{solver}'")
+    return pca.components_, pca.explained_variance_ratio_
+
+
+def perform_pca(tpms, output="plot.png", **kwargs):
     """
     Generates the PCA plots
 
     :param tpms: TPM array where columns are each samples and rows are genes
+    :param output: Output image file
+    :param kwargs: Passed to compute_pca
+    :return: (components x samples array, explained variance ratio)
     """
-    pca = PCA()
-    pca.fit(tpms)
-    var = pca.components_
+    from matplotlib.patches import Patch
+    plt = pyplot(FONT)
+    p = palette()
+    var, ratio = compute_pca(tpms, **kwargs)
     lc = []
     colors = []
-    for con, col in zip(CONDITIONS, COND_COLORS):
+    for con, col in zip(CONDITIONS, condition_colors()):
         lc.append(Patch(label=con, color=col))
         for i in range(REPLICATES):
             colors.append(col)
 
-    percentages = [round(x, 2) for x in pca.explained_variance_ratio_ * 100]
+    percentages = [round(x, 2) for x in ratio * 100]
     plt.legend(handles=lc, loc=0)
     plt.scatter(var[0, :], var[1, :], color=colors, s=100)
     plt.xlabel(f"PC1: {percentages[0]} %")
@@ -97,55 +215,125 @@ def perform_pca(tpms):
     plt.gca().set_facecolor(p.gray(shade=BACKGROUND_GRAY))
     plt.grid(axis="both", ls=":", alpha=0.7)
     plt.tight_layout()
-    plt.savefig("plot.png", dpi=300)
+    plt.savefig(output, dpi=300)
     plt.show()
+    plt.close()
+    return var, ratio
 
 
-def plot_dendrogram(model, **kwargs):
-    # Create linkage matrix and then plot the dendrogram
+def run_pca(files=None, output="plot.png", **kwargs):
+    """
+    PCA of the quantification files (default: get_raw_files())
+
+    :param output: Output image file
+    :param kwargs: Passed to compute_pca
+    """
+    return perform_pca(extract_expression(files or get_raw_files()),
+                       output=output, **kwargs)
 
-    # create the counts of samples under each node
-    counts = np.zeros(model.children_.shape[0])
-    n_samples = len(model.labels_)
-    for i, merge in enumerate(model.children_):
-        current_count = 0
-        for child_idx in merge:
-            if child_idx < n_samples:
-                current_count += 1  # leaf node
-            else:
-                current_count += counts[child_idx - n_samples]
-        counts[i] = current_count
 
-    linkage_matrix = np.column_stack([model.children_, model.distances_,
-                                      counts]).astype(float)
+@traced
+def sample_distances(tpms, metric="cityblock", chunk_size=5000,
+                     workers=None) -> np.ndarray:
+    """
+    Condensed pairwise distance matrix between samples (columns). For
+    additive metrics ('cityblock', 'euclidean', 'sqeuclidean') genes are
+    processed in float32 chunks on a thread pool and the partial sums are
+    added up. Results are cached in memory for the given data and metric.
 
+    :param tpms: Numpy array of TMP values where columns are samples and
+    rows are genes
+    :param metric: Any metric accepted by scipy.spatial.distance.pdist
+    :param chunk_size: Number of genes in one chunk
+    :param workers: Number of threads
+    :return: Condensed distance matrix (as used by hierarchy.linkage)
+    """
+    from scipy.spatial.distance import pdist
+    data = np.ascontiguousarray(tpms, dtype=np.float32)
+    key = (hashlib.sha1(data.view(np.uint8)).hexdigest(), data.shape, metric)
+    if key in _DISTANCES:
+        return _DISTANCES[key]
+
+    if metric in ["cityblock", "euclidean", "sqeuclidean"]:
+        partial_metric = "cityblock" if metric == "cityblock" \
+            else "sqeuclidean"
+        starts = range(0, data.shape[0], chunk_size)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            parts = pool.map(
+                lambda x: pdist(data[x:x + chunk_size].T, partial_metric),
+                starts)
+            dist = np.sum(list(parts), axis=0)
+        if metric == "euclidean":
+            dist = np.sqrt(dist)
+    else:
+        dist = pdist(data.T, metric)
+    _DISTANCES[key] = dist
+    return dist
+
+
+def sample_linkage(tpms, metric="cityblock", method="complete"):
+    """
+    Linkage matrix of the samples. Distances are reused between calls,
+    so different linkage methods can be compared cheaply.
+    """
+    from scipy.cluster import hierarchy
+    return hierarchy.linkage(sample_distances(tpms, metric=metric),
+                             method=method)
+
+
+def compare_linkages(tpms, metrics=("cityblock", "euclidean"),
+                     methods=("complete", "average", "ward")) -> dict:
+    """
+    Cophenetic correlation of all metric and linkage combinations. Ward
+    linkage is only computed for euclidean distances.
+
+    :return: dict of (metric, method) -> cophenetic correlation
+    """
+    from scipy.cluster import hierarchy
+    result = {}
+    for metric in metrics:
+        dist = sample_distances(tpms, metric=metric)
+        for method in methods:
+            if method in ["ward", "centroid", "median"] and \
+                    metric != "euclidean":
+                continue
+            result[(metric, method)] = hierarchy.cophenet(
+                hierarchy.linkage(dist, method=method), dist)[0]
+    return result
+
+
+def plot_dendrogram(linkage_matrix, **kwargs):
+    from scipy.cluster import hierarchy
     labels = []
     for c in CONDITIONS:
         for i in range(REPLICATES):
             labels.append(f"{c}_{i + 1}")
     labels = np.asarray(labels)
     # Plot the corresponding dendrogram
-    hierarchy.set_link_color_palette(COND_COLORS)
-    dendrogram(linkage_matrix, **kwargs, labels=labels)
+    hierarchy.set_link_color_palette(condition_colors())
+    hierarchy.dendrogram(linkage_matrix, **kwargs, labels=labels)
 
 
-def hierarchical_clustering(tpms):
+def hierarchical_clustering(tpms, metric="cityblock", method="complete",
+                            output="plot.png"):
     """
     Generates the clustering and plots it dendogram. Change the clustering
     parameters according to your dataset.
 
     :param tpms: Numpy array of TMP values where columns are samples and
     rows are genes
+    :param metric: Distance metric (cityblock is the Manhattan distance)
+    :param method: Linkage method
+    :param output: Output image file
     """
+    from matplotlib.collections import LineCollection
+    plt = pyplot(FONT)
+    p = palette()
 
-    clustering = AgglomerativeClustering(
-        distance_threshold=0, n_clusters=None,
-        affinity="manhattan",
-        linkage="complete")
-    model = clustering.fit(tpms.transpose())
+    linkage_matrix = sample_linkage(tpms, metric=metric, method=method)
     # fig = plt.figure(figsize=(8, 6))
     ax = plt.subplot(111)  # type: plt.Axes
-    plot_dendrogram(model, truncate_mode=None, ax=ax,
+    plot_dendrogram(linkage_matrix, truncate_mode=None, ax=ax,
                     orientation="right")
     plt.xlabel("Distance")
     for c in ax.get_children():
@@ -153,33 +341,77 @@ def hierarchical_clustering(tpms):
             c.set_linewidth(2)
     ax.set_facecolor(p.gray(shade=BACKGROUND_GRAY))
     plt.tight_layout()
-    plt.savefig("plot.png", dpi=300)
+    plt.savefig(output, dpi=300)
     plt.show()
+    plt.close()
+
+
+def run_clustering(files=None, **kwargs):
+    """
+    Clustering of the quantification files (default: get_raw_files())
+
+    :param kwargs: Passed to hierarchical_clustering
+    """
+    hierarchical_clustering(extract_expression(files or get_raw_files()),
+                            **kwargs)
 
 
-def plot_ma(filename: str):
+@traced
+def plot_ma(filename: str, binned=True, bins=250, clip=0.995,
+            output="plot.png"):
     """
     Plots MA-Plot for given DESeq2 output file.
 
     If you are using some custom file, change the column names accordingly
 
     :param filename: Output file generated by DESeq2
+    :param binned: If True, non-significant genes are drawn as a 2D
+    histogram and only significant genes as (rasterized) points. Time and
+    file size then do not depend on number of genes.
+    :param bins: Number of bins along each axis in binned mode
+    :param clip: Quantile of baseMean and |log2FoldChange| used as axis
+    limits
+    :param output: Output image file
     """
+    from matplotlib.colors import LinearSegmentedColormap, LogNorm
+    from matplotlib.patches import Patch
+    plt = pyplot(FONT)
+    p = palette()
     normal_color = p.blue(shade=40)
     rejected_color = p.red(shade=0)
-    color_col = "color"
     threshold = 0.05
-    df = pd.read_csv(filename)
-    df[color_col] = rejected_color
-    df.loc[df['padj'] < threshold, color_col] = normal_color
-
-    plt.scatter(df["baseMean"], df["log2FoldChange"],
-                color=df[color_col], marker=".")
-    plt.ylim(-10, 10)
-    plt.xlim(-5000, 150000)
+    df = pd.read_csv(filename, usecols=["baseMean", "log2FoldChange",
+                                        "padj"])
+    df = df[df["log2FoldChange"].notna()]
+    x = df["baseMean"].to_numpy()
+    y = df["log2FoldChange"].to_numpy()
+    significant = (df['padj'] < threshold).to_numpy()
+
+    x_max = np.quantile(x, clip)
+    y_max = np.ceil(np.quantile(np.abs(y), clip))
+    if binned:
+        counts, xe, ye = np.histogram2d(
+            x[~significant], y[~significant], bins=bins,
+            range=[[0, x_max], [-y_max, y_max]])
+        cmap = LinearSegmentedColormap.from_list(
+            "ma", [rejected_color, p.red(shade=20)])
+        plt.imshow(np.ma.masked_equal(counts.T, 0), cmap=cmap,
+                   norm=LogNorm(), origin="lower", aspect="auto",
+                   extent=[xe[0], xe[-1], ye[0], ye[-1]],
+                   interpolation="nearest", zorder=1)
+        plt.scatter(x[significant], y[significant], color=normal_color,
+                    marker=".", rasterized=True, zorder=2)
+    else:
+        colors = np.where(significant, normal_color, rejected_color)
+        plt.scatter(x, y, color=colors, marker=".", rasterized=True)
+    # After imshow, which resets the limits to its extent
+    plt.xlim(-0.03 * x_max, x_max)
+    plt.ylim(-y_max, y_max)
     plt.axhline(0, ls="--", color=p.black(), alpha=0.5)
     plt.gca().set_facecolor(p.gray(shade=BACKGROUND_GRAY))
-    plt.annotate("Y Clip : (-10 to 10)\n X Clip (0 to 1.4x10$^5$)",
+    plt.annotate(f"Y Clip : ({-y_max:g} to {y_max:g})\n"
+                 f" X Clip (0 to {x_max:.3g})\n"
+                 f"({clip * 100:g}% quantile)",
                  xy=(0.98, 0.05), xycoords="axes fraction",
                  ha="right", va="bottom", color=p.gray(shade=70))
     handles = [
@@ -193,15 +425,101 @@ def plot_ma(filename: str):
     plt.ylabel("Log2 Fold Change")
     plt.xlabel("BaseMean Counts", labelpad=7)
     plt.title("$mia40$ HSF vs $mia40$ Whole")
-    plt.savefig("plot.png", dpi=300)
+    plt.savefig(output, dpi=300)
     plt.show()
+    plt.close()
+
 
+def summarize_deseq2(filename: str, threshold=0.05, points=1000) -> dict:
+    """
+    Summary of the log2FoldChange of significant genes in given DESeq2
+    output: significant fraction, quantiles and KDE on a fixed grid
+    (same range as the y-axis of the violin plots).
 
-def plot_box_whisker():
+    :param filename: Output file generated by DESeq2
+    :param threshold: padj threshold
+    :param points: Number of grid points of the KDE
+    :return: Summary; statistics are NaN when there are no significant
+    genes and density is empty when it can not be estimated (less than
+    two distinct values or no grid point within their range)
+    """
+    df = pd.read_csv(filename, usecols=["log2FoldChange", "padj"],
+                     dtype=np.float64)
+    total = len(df)
+    values = df[df["padj"] < threshold]["log2FoldChange"].dropna()
+    values = values.to_numpy()
+    summary = {
+        "total": total,
+        "significant": len(values),
+        "fraction": len(values) / total if total > 0 else 0.0,
+        "mean": np.nan,
+        "median": np.nan,
+        "min": np.nan,
+        "max": np.nan,
+        "quantiles": [np.nan] * 3,
+        "coords": [],
+        "vals": [],
+    }
+    if len(values) == 0:
+        return summary
+    summary.update({
+        "mean": float(np.mean(values)),
+        "median": float(np.median(values)),
+        "min": float(np.min(values)),
+        "max": float(np.max(values)),
+        "quantiles": np.quantile(values, [0.25, 0.5, 0.75]).tolist(),
+    })
+    coords = np.linspace(SUMMARY_RANGE[0], SUMMARY_RANGE[1], points)
+    coords = coords[(coords >= values.min()) & (coords <= values.max())]
+    if len(coords) > 0 and len(np.unique(values)) > 1:
+        summary["coords"] = coords.tolist()
+        summary["vals"] = kde(values, coords).tolist()
+    return summary
+
+
+@traced
+def summarize_deseq2_files(filenames: list, summary_file=DESEQ2_SUMMARY,
+                           workers=None) -> dict:
+    """
+    Summarizes all DESeq2 outputs in parallel (see summarize_deseq2) and
+    stores the summaries in a single JSON file. Files whose content did
+    not change since the last call are not read again.
+
+    :param filenames: DESeq2 output files
+    :param summary_file: Where summaries are stored
+    :param workers: Number of processes
+    :return: dict of filename -> summary
+    """
+    stored = {}
+    if os.path.isfile(summary_file):
+        with open(summary_file) as f:
+            stored = json.load(f)
+    hashes = {f: file_hash(f) for f in filenames}
+    missing = [f for f in filenames
+               if stored.get(f, {}).get("hash") != hashes[f]]
+    if len(missing) > 0:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for f, summary in zip(missing,
+                                  pool.map(summarize_deseq2, missing)):
+                stored[f] = {"hash": hashes[f], **summary}
+        folder = os.path.dirname(summary_file)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        with atomic_write(summary_file) as tmp:
+            with open(tmp, "w") as f:
+                json.dump(stored, f)
+    return {f: stored[f] for f in filenames}
+
+
+def plot_box_whisker(output="plot.png"):
     """
     Statistics of Log2Fold values generated by DESeq2. Change the file
     names, label names and colors according to your study
+
+    :param output: Output image file
     """
+    plt = pyplot(FONT)
+    p = palette()
 
     # Output files generated by DESeq2
     samples = [
@@ -218,17 +536,19 @@ def plot_box_whisker():
     colors = [p.cyan, p.magenta, p.yellow, p.green_light]
 
     significant = []
+    summaries = summarize_deseq2_files([f"deseq2/{s}" for s in samples])
 
     for i, s in enumerate(samples):
-        df = pd.read_csv(f"deseq2/{s}")
-        total = len(df)
-        df = df[df["padj"] < 0.05]
-        significant.append(len(df) * 100 / total)
-        vl = plt.violinplot(df["log2FoldChange"],
-                            points=1000,
-                            showextrema=False,
-                            quantiles=[0.25, 0.5, 0.75],
-                            positions=[i])
+        summary = summaries[f"deseq2/{s}"]
+        significant.append(summary["fraction"] * 100)
+        if len(summary["coords"]) == 0:
+            continue
+        stats = {k: np.asarray(summary[k]) for k in
+                 ["coords", "vals", "mean", "median", "min", "max",
+                  "quantiles"]}
+        vl = plt.gca().violin([stats],
+                              showextrema=False,
+                              positions=[i])
 
         for v in vl:
             if v == "bodies":
@@ -256,8 +576,9 @@ def plot_box_whisker():
                  bbox=dict(color=p.gray(shade=20), alpha=0.8),
                  ha="center")
     plt.ylim(-10, 10)
-    plt.savefig("plot.png", dpi=300)
+    plt.savefig(output, dpi=300)
     plt.show()
+    plt.close()
 
 
 def run():
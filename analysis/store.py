@@ -0,0 +1,103 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Partitioned (Parquet) store of enrichment results of many contrasts
+
+import os
+import shutil
+import threading
+
+import pandas as pd
+
+from helpers.trace import traced
+
+ENRICHMENT_STORE = "enrichment"
+PARTITIONS = ["contrast", "source", "query"]
+
+
+class EnrichmentStore:
+    """
+    Enrichment results of all contrasts in one Parquet dataset partitioned
+    by contrast, source and query (e.g. 'enrichment/contrast=hsf/
+    source=KEGG/query=up/'). Filters are pushed down to the reader, so
+    only matching partitions (and row groups) are read. Requires pyarrow.
+    """
+
+    def __init__(self, root=ENRICHMENT_STORE):
+        self.root = root
+
+    @traced(count=lambda x: None)
+    def write(self, df: pd.DataFrame, contrast: str):
+        """
+        Stores results of one contrast (replacing earlier results of the
+        same contrast). The contrast is written into a temporary folder
+        next to the store and renamed into place, so readers never see it
+        partly written.
+        """
+        df = df.assign(contrast=contrast)
+        # Lists can not be partitioned consistently across backends
+        df["parents"] = df["parents"].astype(str)
+        df = df.sort_values(by="p_value")
+        tmp = f"{self.root}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            df.to_parquet(tmp, partition_cols=PARTITIONS, index=False)
+            os.makedirs(self.root, exist_ok=True)
+            for name in os.listdir(tmp):
+                folder = os.path.join(self.root, name)
+                old = f"{tmp}.old"
+                # Directories can not be replaced, so the old one is moved
+                # away first and removed after the new one is in place
+                if os.path.isdir(folder):
+                    os.rename(folder, old)
+                os.rename(os.path.join(tmp, name), folder)
+                if os.path.isdir(old):
+                    shutil.rmtree(old)
+        finally:
+            if os.path.isdir(tmp):
+                shutil.rmtree(tmp)
+
+    def contrasts(self) -> list:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(x.split("=", 1)[1] for x in os.listdir(self.root)
+                      if x.startswith("contrast="))
+
+    @traced
+    def query(self, contrast=None, source=None, query=None, max_p=None,
+              top=None, exclude=None, columns=None) -> pd.DataFrame:
+        """
+        :param contrast: Contrast name or list of names
+        :param source: Source (e.g. KEGG, GO:BP) or list of sources
+        :param query: 'up', 'down' or list of them
+        :param max_p: Keep only terms with p_value <= max_p
+        :param top: Keep only this many most significant terms for every
+        (contrast, source, query)
+        :param exclude: Term IDs to drop (e.g. root nodes)
+        :param columns: Columns to read (partition columns are always
+        returned)
+        :return: DataFrame sorted by p_value
+        """
+        filters = []
+        for col, value in zip(PARTITIONS, [contrast, source, query]):
+            if value is not None:
+                if isinstance(value, str):
+                    value = [value]
+                filters.append((col, "in", list(value)))
+        if max_p is not None:
+            filters.append(("p_value", "<=", max_p))
+        if columns is not None:
+            columns = list(dict.fromkeys(list(columns) + ["p_value"] +
+                                         PARTITIONS))
+        df = pd.read_parquet(self.root, filters=filters or None,
+                             columns=columns)
+        for col in PARTITIONS:
+            if col in df.columns:
+                df[col] = df[col].astype(str)
+        if exclude is not None:
+            df = df[~df["native"].isin(exclude)]
+        df = df.sort_values(by="p_value", kind="mergesort")
+        if top is not None:
+            df = df.groupby(PARTITIONS, sort=False).head(top)
+        return df.reset_index(drop=True)
@@ -0,0 +1,99 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Term hierarchy (GO / KEGG parents) of the enrichment results
+
+import re
+
+import numpy as np
+import pandas as pd
+
+
+def _parse_parents(value) -> list:
+    """
+    Parent IDs from a list or its string form (e.g. "['GO:1', 'GO:2']" or
+    "['GO:1' 'GO:2']" of NumPy arrays). IDs may contain '-' and '_'.
+    """
+    if isinstance(value, str):
+        if value in ["", "nan", "None"]:
+            return []
+        value = [x.strip("'\"") for x in
+                 re.split(r"[,\s]+", value.strip("[] "))]
+    elif value is None or (np.isscalar(value) and pd.isna(value)):
+        return []
+    return [str(x) for x in value if x != ""]
+
+
+class TermGraph:
+    """
+    Term DAG with integer node IDs. Edges are stored as a sparse
+    (child x parent) matrix, so parents of any set of terms (and the full
+    ancestor closure) are found without Python loops over rows.
+
+    :param terms: Term IDs (e.g. 'native' column of the results)
+    :param parents: List of parent IDs for each term
+    """
+
+    def __init__(self, terms, parents):
+        from scipy import sparse
+        terms = list(terms)
+        ids = pd.unique(pd.Series(
+            terms + [x for p in parents for x in p], dtype=object))
+        self.ids = np.asarray(ids, dtype=str)
+        self._index = pd.Index(self.ids)
+        child = np.repeat(self.position(terms),
+                          [len(p) for p in parents])
+        parent = self.position([x for p in parents for x in p])
+        n = len(self.ids)
+        self.adjacency = sparse.csr_matrix(
+            (np.ones(len(child), dtype=bool), (child, parent)),
+            shape=(n, n))
+
+    @classmethod
+    def from_results(cls, df: pd.DataFrame):
+        """
+        Builds graph from enrichment results (g:Profiler columns). The
+        'parents' column can hold lists or their string form (as stored
+        in the EnrichmentStore).
+        """
+        parents = [_parse_parents(x) for x in df["parents"]]
+        return cls(df["native"].to_numpy(), parents)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, terms) -> np.ndarray:
+        """Integer node IDs of given terms (-1 if absent)"""
+        return self._index.get_indexer(list(terms))
+
+    def mask(self, terms) -> np.ndarray:
+        """Boolean vector over all nodes marking given terms"""
+        return np.isin(self.ids, np.asarray(list(terms), dtype=str))
+
+    def edges(self, nodes=None):
+        """
+        :param nodes: Optional boolean mask; only edges between these
+        nodes are returned
+        :return: (parent, child) arrays of integer node IDs
+        """
+        coo = self.adjacency.tocoo()
+        child, parent = coo.row, coo.col
+        if nodes is not None:
+            keep = nodes[child] & nodes[parent]
+            child, parent = child[keep], parent[keep]
+        return parent, child
+
+    def ancestors(self, terms) -> np.ndarray:
+        """
+        Mask of the given terms together with all their ancestors
+        """
+        closure = self.mask(terms)
+        frontier = closure.copy()
+        transposed = self.adjacency.T.tocsr()
+        while frontier.any():
+            reached = (transposed @ frontier.astype(np.int8)) > 0
+            frontier = reached & ~closure
+            closure |= reached
+        return closure
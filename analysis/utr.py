@@ -3,44 +3,59 @@
 #
 #  UTR Analysis and related statistics
 
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import numpy as np
-import pandas as pd
-from SecretColors import Palette
-from matplotlib.patches import Patch
-from scipy.stats import gaussian_kde
-from scipy.stats import ttest_ind
 
-from helpers.common import extract_utr_sequence, get_genes
+from analysis.resampling import permutation_test
+from helpers.cache import BuildCache, content_key, file_hash
+from helpers.common import gene_file, get_gene_set, get_genes
 from helpers.constants import *
+from helpers.context import COL_NAME, COL_TRANSCRIPT, get_context
+from helpers.density import kde, violin_stats
+from helpers.genesets import membership, region_sizes
+from helpers.plotting import figure, palette, pyplot
+from helpers.trace import span, traced
+
+SWEEP_MANIFEST = "figs/.sweep_cache.json"
+
 
-p = Palette()
+@traced
+def filter_utrs(genes, utr=3) -> list:
+    """
+    Selects the longest transcript of every gene which has UTR sequence
+    available. Only sequences of the selected transcripts are read.
 
+    Genes are counted by gene ID, same as in the UTR table used by the
+    plots (genes sharing a name, or without a name, are not merged).
 
-def filter_utrs(genes, seq) -> list:
-    df = pd.read_csv(FILE_MAPPING)
-    df = df.sort_values(by="Transcript length (including UTRs and CDS)",
-                        ascending=False)
-    seq = pd.DataFrame.from_dict(seq, orient="index")
-    seq = seq.rename(columns={0: "sequence"})
-    df = df.set_index("Transcript stable ID")
-    df = pd.concat([df, seq], axis=1)
-    del seq
-    df = df[df["Gene stable ID"].isin(genes)]
-    df = df[df['sequence'].notna()]
-    df = df.sort_values(by=["Transcript length (including UTRs "
-                            "and CDS)"], ascending=False)
-    df = df.drop_duplicates(subset=["Gene stable ID"])
-    df = dict(zip(df["Gene name"], df["sequence"]))
-    df = [(k, v) for k, v in df.items()]
-    return df
+    :param genes: Gene IDs
+    :param utr: 5 or 3
+    :return: list of (gene name, sequence), one for every gene
+    """
+    ctx = get_context()
+    index = ctx.utr(utr)
+    df = ctx.longest(utr)
+    df = df[df.index.isin(genes)]
+    sequences = [index.sequence(x) for x in df[COL_TRANSCRIPT]]
+    return list(zip(df[COL_NAME], sequences))
 
 
+@traced
 def plot_utr_length_distribution(conditions, direction, atlas,
                                  filename="plot.png",
-                                 threshold=0, use_limit=None
+                                 threshold=0, use_limit=None,
+                                 permutations=0
                                  ):
-    plt.clf()
+    """
+    :param permutations: If > 0, a permutation test (Mann-Whitney U, see
+    analysis.resampling) with that many permutations is reported next to
+    the Welch's t-test
+    """
+    from scipy.stats import ttest_ind
+    p = palette()
+    fig = figure()
+    ax = fig.add_subplot()
     x_lim = 2000
     colors = [p.cyan, p.magenta]
 
@@ -55,47 +70,48 @@ def plot_utr_length_distribution(conditions, direction, atlas,
                           atlas=atlas,
                           threshold=threshold,
                           use_limit=use_limit)
-        raw = extract_utr_sequence(3)
-        utr = filter_utrs(genes, raw)
-        values = [len(x[1]) for x in utr]
+        values = get_context().table(3).lengths(genes)
         samples.append([x for x in values])
         mean_value = sum(values) / len(values)
         total.append(len(values))
         print(f"{condition.upper()} Total : {len(values)}")
         print(f"{condition.upper()} Average : {round(mean_value, 2)}")
 
-        density_utr = gaussian_kde(values)
         xs = np.linspace(0, x_lim, 200)
-        plt.plot(xs, density_utr(xs), color=colors[i](),
-                 lw=2, label=f"{condition.upper()}",
-                 zorder=3)
-        plt.axvline(mean_value, color=colors[i](), ls="--")
-        txt_loc = plt.gca().get_ylim()[1] / 2
+        ax.plot(xs, kde(values, xs), color=colors[i](),
+                lw=2, label=f"{condition.upper()}",
+                zorder=3)
+        ax.axvline(mean_value, color=colors[i](), ls="--")
+        txt_loc = ax.get_ylim()[1] / 2
         align = "right"
         if i == 0:
             align = "left"
 
-        plt.annotate(f"{round(mean_value, 2)}",
-                     xy=(mean_value, txt_loc),
-                     rotation=90, ha=align, va="center",
-                     bbox=dict(fc=p.white(), ec=colors[i]()))
+        ax.annotate(f"{round(mean_value, 2)}",
+                    xy=(mean_value, txt_loc),
+                    rotation=90, ha=align, va="center",
+                    bbox=dict(fc=p.white(), ec=colors[i]()))
 
     # Welch's unequal variances t-test
-    tt = ttest_ind(a=samples[0], b=samples[1], equal_var=False)
+    with span("ttest_ind"):
+        tt = ttest_ind(a=samples[0], b=samples[1], equal_var=False)
 
-    plt.xlabel("UTR length")
-    plt.ylabel("Frequency (density)")
-    plt.legend(loc=0)
-    plt.grid(zorder=0, ls=":")
-    ax = plt.gca()
+    ax.set_xlabel("UTR length")
+    ax.set_ylabel("Frequency (density)")
+    ax.legend(loc=0)
+    ax.grid(zorder=0, ls=":")
     ax.set_facecolor(p.gray(shade=15))
     round_fig = int(np.log10(tt[1])) * -1 + 1
-    plt.annotate(f"p-value : {round(tt[1], round_fig)}"
-                 f"\n\nLengths above {x_lim}\nare not shown"
-                 f"\n\n n = {total[0]} ({conditions[0]}),"
-                 f"\n {total[1]} ({conditions[1]})",
-                 (0.96, 0.81), ha="right", xycoords="axes fraction", va="top",
-                 fontstyle="italic", color=p.gray(shade=70))
+    perm_txt = ""
+    if permutations > 0:
+        perm = permutation_test(samples[0], samples[1], n=permutations)
+        perm_txt = f"\nperm. p (MWU) : {perm['p_u']:.2g}"
+    ax.annotate(f"p-value : {round(tt[1], round_fig)}{perm_txt}"
+                f"\n\nLengths above {x_lim}\nare not shown"
+                f"\n\n n = {total[0]} ({conditions[0]}),"
+                f"\n {total[1]} ({conditions[1]})",
+                (0.96, 0.81), ha="right", xycoords="axes fraction", va="top",
+                fontstyle="italic", color=p.gray(shade=70))
 
     if use_limit is not None:
         tsh = f"{use_limit[0]} <= Log2FC <= {use_limit[1]}"
@@ -104,32 +120,42 @@ def plot_utr_length_distribution(conditions, direction, atlas,
             tsh = f"Log2FC >= {threshold}"
         else:
             tsh = f"Log2FC <= {threshold}"
-    plt.title(f"{direction} regulated genes "
-              f"[{atlas}, {tsh}]")
-    plt.tight_layout()
-    plt.savefig(filename, dpi=300)
-    # plt.show()
+    ax.set_title(f"{direction} regulated genes "
+                 f"[{atlas}, {tsh}]")
+    fig.tight_layout()
+    with span("savefig", file=filename):
+        fig.savefig(filename, dpi=300)
+    return filename
 
 
+@traced
 def common_gene_analysis(conditions, *,
                          direction, atlas, threshold, use_limit,
-                         filename="plot.png"):
-    plt.clf()
+                         filename="plot.png", permutations=0):
+    """
+    :param permutations: If > 0, permutation tests (Mann-Whitney U, see
+    analysis.resampling) with that many permutations are reported next to
+    the Welch's t-tests
+    """
+    from scipy.stats import ttest_ind
+    p = palette()
+    fig = figure()
+    ax = fig.add_subplot()
     x_lim = 2000
-    wt = get_genes(direction=direction,
-                   condition=conditions[0],
-                   atlas=atlas,
-                   use_limit=use_limit,
-                   threshold=threshold)
-    mia40 = get_genes(direction=direction,
-                      condition=conditions[1],
+    wt = get_gene_set(direction=direction,
+                      condition=conditions[0],
                       atlas=atlas,
                       use_limit=use_limit,
                       threshold=threshold)
+    mia40 = get_gene_set(direction=direction,
+                         condition=conditions[1],
+                         atlas=atlas,
+                         use_limit=use_limit,
+                         threshold=threshold)
 
-    common = list(set(wt).intersection(set(mia40)))
-    wt_only = list(set(wt).difference(set(mia40)))
-    mia40_only = list(set(mia40).difference(set(wt)))
+    common = (wt & mia40).genes()
+    wt_only = (wt - mia40).genes()
+    mia40_only = (mia40 - wt).genes()
 
     new_conds = [common, wt_only, mia40_only]
     labels = [f"common (n={len(common)})",
@@ -139,39 +165,44 @@ def common_gene_analysis(conditions, *,
     samples = []
 
     for i in range(len(new_conds)):
-        raw = extract_utr_sequence(3)
-        utr = filter_utrs(new_conds[i], raw)
-        values = [len(x[1]) for x in utr]
+        values = get_context().table(3).lengths(new_conds[i])
         samples.append([x for x in values])
+        xs = np.linspace(0, x_lim, 200)
         try:
-            density_utr = gaussian_kde(values)
+            density_utr = kde(values, xs)
         except ValueError:
             print("Skiped.....")
             print(filename)
-            return
-        xs = np.linspace(0, x_lim, 200)
-        plt.plot(xs, density_utr(xs), color=colors[i](),
-                 lw=2, label=f"{labels[i]}",
-                 zorder=3)
-
-    tt1 = ttest_ind(a=samples[0], b=samples[1], equal_var=False)
-    tt2 = ttest_ind(a=samples[0], b=samples[2], equal_var=False)
-
-    plt.xlabel("UTR length")
-    plt.ylabel("Frequency (density)")
-    plt.legend(loc=0)
-    plt.grid(zorder=0, ls=":")
-    ax = plt.gca()
+            return None
+        ax.plot(xs, density_utr, color=colors[i](),
+                lw=2, label=f"{labels[i]}",
+                zorder=3)
+
+    with span("ttest_ind"):
+        tt1 = ttest_ind(a=samples[0], b=samples[1], equal_var=False)
+        tt2 = ttest_ind(a=samples[0], b=samples[2], equal_var=False)
+
+    ax.set_xlabel("UTR length")
+    ax.set_ylabel("Frequency (density)")
+    ax.legend(loc=0)
+    ax.grid(zorder=0, ls=":")
     ax.set_facecolor(p.gray(shade=15))
 
     round_fig1 = int(np.log10(tt1[1])) * -1 + 1
     round_fig2 = int(np.log10(tt2[1])) * -1 + 1
-    plt.annotate(f"p-value : "
-                 f"\n common vs {conditions[0]} : {round(tt1[1], round_fig1)}"
-                 f"\n common vs {conditions[1]} : {round(tt2[1], round_fig2)}"
-                 f"\n\nLengths above {x_lim}\nare not shown",
-                 (0.96, 0.78), ha="right", xycoords="axes fraction", va="top",
-                 fontstyle="italic", color=p.gray(shade=70))
+    perm_txt = ""
+    if permutations > 0:
+        perm1 = permutation_test(samples[0], samples[1], n=permutations)
+        perm2 = permutation_test(samples[0], samples[2], n=permutations)
+        perm_txt = (f"\nperm. p (MWU) : {perm1['p_u']:.2g}, "
+                    f"{perm2['p_u']:.2g}")
+    ax.annotate(f"p-value : "
+                f"\n common vs {conditions[0]} : {round(tt1[1], round_fig1)}"
+                f"\n common vs {conditions[1]} : {round(tt2[1], round_fig2)}"
+                f"{perm_txt}"
+                f"\n\nLengths above {x_lim}\nare not shown",
+                (0.96, 0.78), ha="right", xycoords="axes fraction", va="top",
+                fontstyle="italic", color=p.gray(shade=70))
 
     if use_limit is not None:
         tsh = f"{use_limit[0]} <= Log2FC <= {use_limit[1]}"
@@ -180,14 +211,59 @@ def common_gene_analysis(conditions, *,
             tsh = f"Log2FC >= {threshold}"
         else:
             tsh = f"Log2FC <= {threshold}"
-    plt.title(f"{direction} regulated genes "
-              f"[{atlas}, {tsh}]")
-    plt.tight_layout()
-    plt.savefig(filename, dpi=300)
-    # plt.show()
-
-
-def violin_plots():
+    ax.set_title(f"{direction} regulated genes "
+                 f"[{atlas}, {tsh}]")
+    fig.tight_layout()
+    with span("savefig", file=filename):
+        fig.savefig(filename, dpi=300)
+    return filename
+
+
+@traced
+def upset_analysis(conditions=("hsf wt", "hsf mia40", "mars wt",
+                               "mars mia40"), *,
+                   direction, atlas, threshold=0, use_limit=None):
+    """
+    Overlap of DE genes of all given conditions. Every exclusive region
+    (UpSet style) is reported with its size and UTR lengths of its genes.
+
+    :return: list of (conditions in the region, number of genes, numpy
+    array of 3'UTR lengths) for all non-empty regions
+    """
+    sets = [get_gene_set(direction=direction,
+                         condition=c,
+                         atlas=atlas,
+                         threshold=threshold,
+                         use_limit=use_limit) for c in conditions]
+    code = membership(sets)
+    codes, sizes = region_sizes(code)
+    lengths = get_context().table(3).lookup(sets[0].universe)
+    has_utr = lengths >= 0
+    order = np.argsort(code[has_utr], kind="mergesort")
+    sorted_codes = code[has_utr][order]
+    starts = np.searchsorted(sorted_codes, codes, side="left")
+    stops = np.searchsorted(sorted_codes, codes, side="right")
+    sorted_lengths = lengths[has_utr][order]
+    regions = []
+    for r, size, start, stop in zip(codes, sizes, starts, stops):
+        if r == 0:
+            continue
+        names = tuple(c for i, c in enumerate(conditions) if r >> i & 1)
+        regions.append((names, int(size), sorted_lengths[start:stop]))
+    return regions
+
+
+def violin_plots(permutations=0, output="plot.png"):
+    """
+    :param permutations: If > 0, permutation tests (Mann-Whitney U, see
+    analysis.resampling) with that many permutations are reported next to
+    the Welch's t-tests
+    :param output: Output image file
+    """
+    from matplotlib.patches import Patch
+    from scipy.stats import ttest_ind
+    plt = pyplot()
+    p = palette()
     direction = "up"
     atlas = "general"
 
@@ -201,14 +277,12 @@ def violin_plots():
         genes = get_genes(direction=direction,
                           condition=condition,
                           atlas=atlas)
-        raw = extract_utr_sequence(3)
-        utr = filter_utrs(genes, raw)
-        values = [len(x[1]) for x in utr]
+        values = get_context().table(3).lengths(genes)
         samples.append([x for x in values])
-        vl = plt.violinplot(values,
-                            vert=False,
-                            positions=[counter],
-                            showextrema=False)
+        vl = plt.gca().violin([violin_stats(values)],
+                              vert=False,
+                              positions=[counter],
+                              showextrema=False)
         for v in vl:
             if v == "bodies":
                 for b in vl[v]:
@@ -228,6 +302,12 @@ def violin_plots():
     # Welch's unequal variances t-test
     tt1 = ttest_ind(a=samples[0], b=samples[1], equal_var=False)
     tt2 = ttest_ind(a=samples[2], b=samples[3], equal_var=False)
+    perm_txt = ""
+    if permutations > 0:
+        perm1 = permutation_test(samples[0], samples[1], n=permutations)
+        perm2 = permutation_test(samples[2], samples[3], n=permutations)
+        perm_txt = (f"\nperm. p (MWU) : {perm1['p_u']:.2g}, "
+                    f"{perm2['p_u']:.2g}")
 
     plt.xlabel("UTR Length")
     plt.gca().set_facecolor(p.gray(shade=10))
@@ -239,7 +319,8 @@ def violin_plots():
     ]
     plt.annotate(f"p-value : "
                  f"\n MARS (wt vs mia40) : {tt1[1]}"
-                 f"\n  HSF (wt vs mia40) : {tt2[1]}",
+                 f"\n  HSF (wt vs mia40) : {tt2[1]}"
+                 f"{perm_txt}",
                  (0.96, 0.5), ha="right",
                  xycoords="axes fraction",
                  va="center",
@@ -248,27 +329,41 @@ def violin_plots():
     plt.legend(handles=handles, loc=0)
     plt.ylim(-0.5, 1.5)
     plt.tight_layout()
-    plt.savefig("plot.png", dpi=300)
+    plt.savefig(output, dpi=300)
     plt.show()
-
-
-def generate_combinations():
-    atlas = "mitocarta"
-    thresholds = [
-        0.5, -0.5, 1, -1,
-        [-1, -0.5], [0.5, 1]
-    ]
-    cond_pairs = [
-        ("hsf wt", "mars wt", "wt"),
-        ("hsf mia40", "mars mia40", "mia40"),
-        ("hsf wt", "hsf mia40", "hsf"),
-        ("mars wt", "mars mia40", "mars"),
-    ]
-
-    fig_pair = []
-    com_pair = []
-    current = []
-    current_com = []
+    plt.close()
+
+
+SWEEP_THRESHOLDS = [
+    0.5, -0.5, 1, -1,
+    [-1, -0.5], [0.5, 1]
+]
+SWEEP_PAIRS = [
+    ("hsf wt", "mars wt", "wt"),
+    ("hsf mia40", "mars mia40", "mia40"),
+    ("hsf wt", "hsf mia40", "hsf"),
+    ("mars wt", "mars mia40", "mars"),
+]
+
+
+def sweep_tasks(atlas="mitocarta", thresholds=None, cond_pairs=None,
+                permutations=0):
+    """
+    Every (condition pair, threshold) cell of the sweep as an independent
+    task. Order of the tasks is the order in which figures appear in the
+    'figs.tex'.
+
+    :param atlas: Atlas of the DE tables
+    :param thresholds: List of log2FC thresholds or [min, max] ranges
+    (default: SWEEP_THRESHOLDS)
+    :param cond_pairs: List of (condition 1, condition 2, label) (default:
+    SWEEP_PAIRS)
+    :param permutations: Permutations of the tests reported in every
+    figure (0 for Welch's t-test only)
+    """
+    thresholds = thresholds or SWEEP_THRESHOLDS
+    cond_pairs = cond_pairs or SWEEP_PAIRS
+    tasks = []
     for pair in cond_pairs:
         for threshold in thresholds:
             use_limit = None
@@ -287,34 +382,142 @@ def generate_combinations():
             th_str = th_str.replace("-", "")
             filename = f"figs/{atlas[:3]}_{direction}_{pair[2]}_{th_str}"
             filename = filename.replace("-", "")
-            filename_com = f"{filename}_cog.png"
-            filename += ".png"
-            plot_utr_length_distribution(direction=direction,
-                                         conditions=(pair[0], pair[1]),
-                                         atlas=atlas,
-                                         threshold=threshold,
-                                         use_limit=use_limit,
-                                         filename=filename)
-            common_gene_analysis(direction=direction,
-                                 conditions=(pair[0], pair[1]),
-                                 atlas=atlas,
-                                 threshold=threshold,
-                                 use_limit=use_limit,
-                                 filename=filename_com)
-
-            current.append(filename)
-            current_com.append(filename_com)
-            if len(current) == 2:
-                fig_pair.append((th_str, current))
-                com_pair.append((th_str, current_com))
-                current = []
-                current_com = []
+            tasks.append({
+                "conditions": (pair[0], pair[1]),
+                "direction": direction,
+                "atlas": atlas,
+                "threshold": threshold,
+                "use_limit": use_limit,
+                "permutations": permutations,
+                "th_str": th_str,
+                "filename": f"{filename}.png",
+                "filename_com": f"{filename}_cog.png",
+            })
+    return tasks
+
+
+@traced
+def run_sweep_task(task: dict):
+    outputs = [plot_utr_length_distribution(direction=task["direction"],
+                                            conditions=task["conditions"],
+                                            atlas=task["atlas"],
+                                            threshold=task["threshold"],
+                                            use_limit=task["use_limit"],
+                                            filename=task["filename"],
+                                            permutations=task["permutations"]),
+               common_gene_analysis(direction=task["direction"],
+                                    conditions=task["conditions"],
+                                    atlas=task["atlas"],
+                                    threshold=task["threshold"],
+                                    use_limit=task["use_limit"],
+                                    filename=task["filename_com"],
+                                    permutations=task["permutations"])]
+    return [x for x in outputs if x is not None]
+
+
+def sweep_task_key(task: dict) -> str:
+    """
+    Content key of the task: hashes of all input files and the plot
+    parameters
+    """
+    inputs = [gene_file(direction=task["direction"], condition=c,
+                        atlas=task["atlas"]) for c in task["conditions"]]
+    inputs.extend([FILE_3UTR, FILE_MAPPING])
+    params = {k: task[k] for k in ["conditions", "direction", "atlas",
+                                   "threshold", "use_limit",
+                                   "permutations"]}
+    return content_key(params, [(f, file_hash(f)) for f in inputs])
+
+
+@traced
+def generate_combinations(workers=None, dry_run=False, force=False,
+                          atlas="mitocarta", thresholds=None,
+                          cond_pairs=None, permutations=0):
+    """
+    Runs the sweep on a process pool and writes 'figs.tex'. Figures are
+    drawn on separate Figure instances, hence tasks do not share any
+    pyplot state. Only figures whose inputs or parameters changed since
+    the last run are drawn again (see SWEEP_MANIFEST).
+
+    :param workers: Number of processes (default: number of CPUs). Use 1
+    to run everything in the current process.
+    :param dry_run: Only print what would be rebuilt
+    :param force: Rebuild everything irrespective of the cache
+    :param atlas: See sweep_tasks
+    :param thresholds: See sweep_tasks
+    :param cond_pairs: See sweep_tasks
+    :param permutations: See sweep_tasks
+    """
+    cache = BuildCache(SWEEP_MANIFEST)
+    tasks = sweep_tasks(atlas=atlas, thresholds=thresholds,
+                        cond_pairs=cond_pairs, permutations=permutations)
+    keys = [sweep_task_key(t) for t in tasks]
+    pending = []
+    for task, key in zip(tasks, keys):
+        outputs = cache.get(task["filename"], "outputs", [])
+        if force or not cache.is_fresh(task["filename"], key, outputs):
+            pending.append((task, key))
+
+    # Every LaTeX block is made from two consecutive tasks
+    blocks = []
+    template_keys = [file_hash("template"), file_hash("template2")]
+    for i in range(0, len(tasks) - 1, 2):
+        th_str = tasks[i + 1]["th_str"]
+        block_key = content_key(keys[i], keys[i + 1], template_keys)
+        blocks.append((f"tex:{tasks[i]['filename']}", block_key, th_str,
+                       [tasks[i]["filename"], tasks[i + 1]["filename"]],
+                       [tasks[i]["filename_com"],
+                        tasks[i + 1]["filename_com"]]))
+    stale = [b for b in blocks if force or not cache.is_fresh(b[0], b[1])]
+
+    if dry_run:
+        for task, _ in pending:
+            print(f"rebuild : {task['filename']}, {task['filename_com']}")
+        for b in stale:
+            print(f"re-emit : figs.tex block for {', '.join(b[3])}")
+        return [t for t, _ in pending]
+
+    if len(pending) > 0:
+        # Build the shared UTR table once, before workers start reading it
+        get_context().table(3)
+    # Every finished task is recorded immediately and the manifest is
+    # saved even if some task fails, so finished figures are not redrawn
+    try:
+        if workers == 1:
+            for task, key in pending:
+                cache.update(task["filename"], key,
+                             outputs=run_sweep_task(task))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(run_sweep_task, t): (t, k)
+                           for t, k in pending}
+                error = None
+                for future in as_completed(futures):
+                    task, key = futures[future]
+                    try:
+                        outputs = future.result()
+                    except Exception as e:
+                        # Keep recording the tasks still running
+                        error = error or e
+                        continue
+                    cache.update(task["filename"], key, outputs=outputs)
+                if error is not None:
+                    raise error
+    finally:
+        cache.save()
+
+    for target, key, th_str, figs, figs_com in stale:
+        text = [get_latex_fig((th_str, figs), "template"),
+                get_latex_fig((th_str, figs_com), "template2",
+                              prefix="cog_")]
+        cache.update(target, key, text=text)
 
     with open("figs.tex", "w") as f:
-        for d in fig_pair:
-            print(get_latex_fig(d, "template"), file=f)
-        for d in com_pair:
-            print(get_latex_fig(d, "template2", prefix="cog_"), file=f)
+        for i in range(2):
+            for b in blocks:
+                print(cache.get(b[0], "text")[i], file=f)
+    cache.save()
+    return [t for t, _ in pending]
 
 
 def get_latex_fig(data, template, prefix=""):
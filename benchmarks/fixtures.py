@@ -0,0 +1,201 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Deterministic synthetic inputs in the same layout as the real data:
+#  BioMart UTR FASTA and mapping files (data/), DE tables (mito/) and
+#  Salmon quantification files (salmon_counts/). Same parameters always
+#  give byte-identical files.
+
+import json
+import os
+import shutil
+
+import numpy as np
+
+FIXTURE_INFO = "fixture.json"
+TRANSCRIPTS_PER_GENE = 2
+UNAVAILABLE_FRACTION = 0.2  # UTRs exported as 'Sequence unavailable'
+LINE_WIDTH = 60
+BATCH = 10000  # Records generated at once
+
+ATLAS = "mitocarta"
+CONDITIONS = ["hsf wt", "hsf mia40", "mars wt", "mars mia40"]
+
+_BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+
+
+def gene_ids(n: int) -> list:
+    return [f"ENSDARG{i:011d}" for i in range(n)]
+
+
+def transcript_ids(n: int) -> list:
+    return [f"ENSDART{i:011d}" for i in range(n)]
+
+
+def _transcript_genes(transcripts: int, genes: int, rng) -> np.ndarray:
+    """Gene of every transcript; every gene has at least one transcript"""
+    owner = rng.integers(0, genes, transcripts)
+    owner[:genes] = np.arange(genes)
+    return owner
+
+
+def write_mapping(filename, t_ids, g_ids, owner, rng):
+    """BioMart transcript to gene mapping (some genes have no name)"""
+    named = rng.random(len(g_ids)) >= 0.1
+    lengths = np.round(rng.lognormal(7.6, 0.6, len(t_ids))).astype(int)
+    with open(filename, "w") as f:
+        print("Gene stable ID,Gene name,Transcript stable ID,"
+              "Transcript length (including UTRs and CDS)", file=f)
+        for i, t in enumerate(t_ids):
+            g = owner[i]
+            name = f"gene{g}" if named[g] else ""
+            print(f"{g_ids[g]},{name},{t},{lengths[i]}", file=f)
+
+
+def write_utr_fasta(filename, t_ids, g_ids, owner, rng, mean_log):
+    """
+    BioMart style UTR export: header 'gene|gene|transcript', sequences
+    wrapped at LINE_WIDTH and 'Sequence unavailable' records
+    """
+    with open(filename, "wb") as f:
+        for start in range(0, len(t_ids), BATCH):
+            stop = min(start + BATCH, len(t_ids))
+            lengths = np.maximum(np.round(
+                rng.lognormal(mean_log, 0.9, stop - start)), 1).astype(int)
+            available = rng.random(stop - start) >= UNAVAILABLE_FRACTION
+            bases = _BASES[rng.integers(0, 4, int(lengths.sum()))]
+            bases = bases.tobytes()
+            offset = 0
+            for i in range(stop - start):
+                t = start + i
+                g = g_ids[owner[t]]
+                f.write(f">{g}|{g}|{t_ids[t]}\n".encode())
+                if available[i]:
+                    seq = bases[offset:offset + lengths[i]]
+                    f.write(b"\n".join(seq[x:x + LINE_WIDTH] for x in
+                                       range(0, len(seq), LINE_WIDTH)))
+                else:
+                    f.write(b"Sequence unavailable")
+                f.write(b"\n")
+                offset += lengths[i]
+
+
+def write_de_table(filename, genes, direction, rng):
+    """DE table with the columns used by helpers.deindex"""
+    log2fc = np.abs(rng.normal(0, 1.5, len(genes)))
+    if direction == "down":
+        log2fc = -log2fc
+    fdr = rng.random(len(genes)) ** 3
+    with open(filename, "w") as f:
+        print("gene_id,log2FC,FDR", file=f)
+        for g, l, p in zip(genes, log2fc, fdr):
+            print(f"{g},{l:.6f},{p:.6g}", file=f)
+
+
+def write_quant(filename, t_ids, lengths, base, rng):
+    """Salmon quant.sf with TPMs scaled to one million"""
+    tpm = base * rng.lognormal(0, 0.5, len(t_ids))
+    tpm = tpm / tpm.sum() * 1e6
+    effective = np.maximum(lengths - 150, 1)
+    reads = tpm * effective / 1000
+    with open(filename, "w") as f:
+        print("Name\tLength\tEffectiveLength\tTPM\tNumReads", file=f)
+        for row in zip(t_ids, lengths, effective, tpm, reads):
+            print("%s\t%d\t%d\t%.6f\t%.3f" % row, file=f)
+
+
+def write_templates(folder):
+    """LaTeX templates used by analysis.utr.get_latex_fig"""
+    for name in ["template", "template2"]:
+        with open(os.path.join(folder, name), "w") as f:
+            print("\\begin{figure}[H]\n"
+                  "\\includegraphics{$FIG1}\\includegraphics{$FIG2}\n"
+                  "\\caption{$COND, $LOG2FC}\\label{fig:$LAB}\n"
+                  "\\end{figure}", file=f)
+
+
+def make_fixtures(folder: str, transcripts=10000, samples=9,
+                  de_genes=None, seed=0) -> dict:
+    """
+    Writes complete set of inputs into the folder (existing content is
+    removed).
+
+    :param folder: Output folder (used as working directory of the
+    benchmarks)
+    :param transcripts: Number of transcripts in the annotation
+    :param samples: Number of Salmon quantification files
+    :param de_genes: Genes in every DE table (default: 10% of genes)
+    :param seed: Seed of all random generators
+    :return: Parameters of the fixture
+    """
+    genes = max(1, transcripts // TRANSCRIPTS_PER_GENE)
+    if de_genes is None:
+        de_genes = max(1, genes // 10)
+    params = {"transcripts": transcripts, "genes": genes,
+              "samples": samples, "de_genes": min(de_genes, genes),
+              "seed": seed}
+
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+    for sub in ["data", "mito", "salmon_counts", "figs"]:
+        os.makedirs(os.path.join(folder, sub))
+
+    # Independent stream for every file, so changing one size does not
+    # change the content of the other files
+    streams = iter(np.random.default_rng(x) for x in
+                   np.random.SeedSequence(seed).spawn(8 + samples))
+    t_ids = transcript_ids(transcripts)
+    g_ids = gene_ids(genes)
+    owner = _transcript_genes(transcripts, genes, next(streams))
+    write_mapping(os.path.join(folder, "data", "trans_to_gene.csv"),
+                  t_ids, g_ids, owner, next(streams))
+    write_utr_fasta(os.path.join(folder, "data", "utr3.fasta"), t_ids,
+                    g_ids, owner, next(streams), mean_log=6.0)
+    write_utr_fasta(os.path.join(folder, "data", "utr5.fasta"), t_ids,
+                    g_ids, owner, next(streams), mean_log=4.8)
+
+    rng = next(streams)
+    for condition in CONDITIONS:
+        condition = condition.replace(" ", "_")
+        for direction in ["up", "down"]:
+            chosen = np.sort(rng.choice(genes, params["de_genes"],
+                                        replace=False))
+            write_de_table(os.path.join(
+                folder, "mito", f"{direction}_{ATLAS}_{condition}.csv"),
+                [g_ids[x] for x in chosen], direction, rng)
+
+    rng = next(streams)
+    lengths = np.round(rng.lognormal(7.6, 0.6, transcripts)).astype(int)
+    base = rng.gamma(0.5, 20, transcripts)
+    for i in range(samples):
+        write_quant(os.path.join(folder, "salmon_counts",
+                                 f"sample_{i + 1}_quant.sf"),
+                    t_ids, lengths, base, next(streams))
+
+    write_templates(folder)
+    with open(os.path.join(folder, FIXTURE_INFO), "w") as f:
+        json.dump(params, f, indent=2)
+    return params
+
+
+def ensure_fixtures(folder: str, transcripts=10000, samples=9,
+                    de_genes=None, seed=0) -> dict:
+    """
+    Same as make_fixtures, but existing fixture with the same parameters
+    is reused
+    """
+    info = os.path.join(folder, FIXTURE_INFO)
+    if os.path.isfile(info):
+        with open(info) as f:
+            params = json.load(f)
+        genes = max(1, transcripts // TRANSCRIPTS_PER_GENE)
+        expected = {"transcripts": transcripts, "genes": genes,
+                    "samples": samples,
+                    "de_genes": min(de_genes or max(1, genes // 10), genes),
+                    "seed": seed}
+        if params == expected:
+            return params
+    return make_fixtures(folder, transcripts=transcripts, samples=samples,
+                         de_genes=de_genes, seed=seed)
@@ -0,0 +1,286 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Benchmarks of the main pipeline stages on synthetic inputs.
+#
+#  Usage:
+#   python -m benchmarks.run --size small
+#   python -m benchmarks.run -t 200000 -s 30 --stages get_genes filter_utrs
+#   python -m benchmarks.run --size small --compare old.json
+#
+#  Every stage runs in a fresh process with the fixture folder as working
+#  directory. Derived files (indexes, caches, figures) are removed before
+#  the stage, so the first run is cold; later runs show the effect of the
+#  in-memory and on-disk caches.
+
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from benchmarks.fixtures import ensure_fixtures
+from helpers.trace import peak_rss_mb
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE_FOLDER = os.path.join(REPO, "benchmarks", "fixtures")
+RESULT_FOLDER = os.path.join(REPO, "benchmarks", "results")
+
+# Preset sizes: (transcripts, samples)
+SIZES = {
+    "small": (10_000, 3),
+    "medium": (100_000, 30),
+    "large": (1_000_000, 300),
+}
+
+# Files and folders created by the stages themselves
+DERIVED = ["cache", "figs", "figs.tex", "fasta", "data/*.fai",
+           "data/*.npz"]
+
+
+def _extract_utr_sequence(workers):
+    from helpers.common import extract_utr_sequence
+    return len(extract_utr_sequence(3))
+
+
+def _filter_utrs(workers):
+    from analysis.utr import filter_utrs
+    from helpers.context import COL_GENE, get_context
+    genes = get_context().mapping[COL_GENE].unique()
+    return len(filter_utrs(genes))
+
+
+def _get_genes(workers):
+    from analysis.utr import sweep_tasks
+    from helpers.common import get_genes
+    total = 0
+    for task in sweep_tasks():
+        for condition in task["conditions"]:
+            total += len(get_genes(direction=task["direction"],
+                                   condition=condition,
+                                   atlas=task["atlas"],
+                                   threshold=task["threshold"],
+                                   use_limit=task["use_limit"]))
+    return total
+
+
+def _extract_expression(workers):
+    from analysis.statistics import extract_expression
+    files = sorted(glob.glob("salmon_counts/*_quant.sf"))
+    return extract_expression(files).shape[0]
+
+
+def _generate_combinations(workers):
+    from analysis.utr import generate_combinations
+    return len(generate_combinations(workers=workers))
+
+
+# Stage name -> function returning number of processed records
+STAGES = {
+    "extract_utr_sequence": _extract_utr_sequence,
+    "filter_utrs": _filter_utrs,
+    "get_genes": _get_genes,
+    "extract_expression": _extract_expression,
+    "generate_combinations": _generate_combinations,
+}
+
+
+def clean(folder: str):
+    """Removes everything the stages derived from the fixture inputs"""
+    for pattern in DERIVED:
+        for path in glob.glob(os.path.join(folder, pattern)):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+    os.makedirs(os.path.join(folder, "figs"))
+
+
+def _cpu_time() -> float:
+    """CPU time of this process and of its finished child processes"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (own.ru_utime + own.ru_stime + children.ru_utime +
+            children.ru_stime)
+
+
+def measure_stage(name: str, folder: str, repeat=3, workers=1) -> dict:
+    """
+    Runs the stage 'repeat' times in the current process. Meant to be
+    called in a fresh process (see run_benchmarks).
+    """
+    if REPO not in sys.path:
+        sys.path.insert(0, REPO)
+    os.chdir(folder)
+    result = {"status": "ok", "rss_before_mb": peak_rss_mb(),
+              "runs": []}
+    try:
+        for _ in range(repeat):
+            wall, cpu = time.perf_counter(), _cpu_time()
+            records = STAGES[name](workers)
+            result["runs"].append({
+                "wall": round(time.perf_counter() - wall, 4),
+                "cpu": round(_cpu_time() - cpu, 4),
+                "peak_rss_mb": peak_rss_mb(),
+            })
+            result["records"] = records
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def git_commit():
+    """(commit, has uncommitted changes) of the repository if available"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO,
+                                capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain",
+                                "--untracked-files=no"], cwd=REPO,
+                               capture_output=True, text=True,
+                               check=True).stdout.strip() != ""
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def run_benchmarks(transcripts=10000, samples=9, de_genes=None, seed=0,
+                   stages=None, repeat=3, workers=1,
+                   folder=FIXTURE_FOLDER) -> dict:
+    """
+    Generates (or reuses) the fixture and benchmarks the stages
+
+    :param transcripts: Number of transcripts of the fixture
+    :param samples: Number of Salmon files of the fixture
+    :param de_genes: Genes in every DE table (see make_fixtures)
+    :param seed: Seed of the fixture
+    :param stages: Names of stages to run (default: all STAGES)
+    :param repeat: Runs per stage (first one is cold)
+    :param workers: Processes used by generate_combinations
+    :param folder: Fixture folder
+    :return: JSON serializable results
+    """
+    folder = os.path.join(folder, f"t{transcripts}_s{samples}_r{seed}")
+    start = time.perf_counter()
+    fixture = ensure_fixtures(folder, transcripts=transcripts,
+                              samples=samples, de_genes=de_genes, seed=seed)
+    fixture["generation_time"] = round(time.perf_counter() - start, 2)
+    commit, dirty = git_commit()
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "fixture": fixture,
+        "repeat": repeat,
+        "stages": {},
+    }
+    for name in stages or STAGES:
+        if name not in STAGES:
+            raise ValueError(f"Unknown stage '{name}'. Available: "
+                             f"{', '.join(STAGES)}")
+        clean(folder)
+        # 'spawn' gives every stage clean imports, caches and peak RSS
+        with ProcessPoolExecutor(max_workers=1,
+                                 mp_context=get_context("spawn")) as pool:
+            results["stages"][name] = pool.submit(
+                measure_stage, name, folder, repeat, workers).result()
+        print(_format_row(name, results["stages"][name]))
+    return results
+
+
+def _format_row(name, stage) -> str:
+    if stage["status"] != "ok":
+        return f"{name:<24} {stage['error']}"
+    walls = ", ".join(f"{r['wall']:.3f}" for r in stage["runs"])
+    return (f"{name:<24} wall {walls} s | peak "
+            f"{stage['runs'][-1]['peak_rss_mb']} MB | "
+            f"{stage['records']} records")
+
+
+def compare(old: dict, new: dict) -> list:
+    """
+    Cold (first run) and warm (best of the rest) wall times of stages
+    present in both results
+
+    :return: list of (stage, old cold, new cold, old warm, new warm)
+    """
+    def _times(stage):
+        walls = [r["wall"] for r in stage["runs"]]
+        return walls[0], min(walls[1:]) if len(walls) > 1 else None
+
+    rows = []
+    for name, stage in new["stages"].items():
+        before = old["stages"].get(name)
+        if before is None or "ok" != stage["status"] or \
+                "ok" != before["status"]:
+            continue
+        (old_cold, old_warm), (new_cold, new_warm) = (_times(before),
+                                                      _times(stage))
+        rows.append((name, old_cold, new_cold, old_warm, new_warm))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of the pipeline stages on synthetic data")
+    parser.add_argument("--size", choices=SIZES,
+                        help="Preset size of the fixture")
+    parser.add_argument("-t", "--transcripts", type=int, default=10000)
+    parser.add_argument("-s", "--samples", type=int, default=9)
+    parser.add_argument("--de-genes", type=int,
+                        help="Genes in every DE table")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", nargs="+", choices=STAGES)
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Processes used by generate_combinations")
+    parser.add_argument("--fixtures", default=FIXTURE_FOLDER)
+    parser.add_argument("-o", "--output", help="Result JSON file")
+    parser.add_argument("--compare", help="Earlier result JSON file")
+    args = parser.parse_args()
+    if args.size is not None:
+        args.transcripts, args.samples = SIZES[args.size]
+
+    results = run_benchmarks(transcripts=args.transcripts,
+                             samples=args.samples, de_genes=args.de_genes,
+                             seed=args.seed, stages=args.stages,
+                             repeat=args.repeat, workers=args.workers,
+                             folder=args.fixtures)
+    output = args.output
+    if output is None:
+        commit = (results["commit"] or "nogit")[:10]
+        output = os.path.join(RESULT_FOLDER, f"{commit}_t{args.transcripts}"
+                                             f"_s{args.samples}.json")
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved in {output}")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print(f"{'stage':<24} {'cold (old -> new)':>24} "
+              f"{'warm (old -> new)':>24}")
+        for name, oc, nc, ow, nw in compare(old, results):
+            warm = f"{ow} -> {nw}" if ow is not None else "-"
+            print(f"{name:<24} {f'{oc} -> {nc} ({nc / oc:.2f}x)':>24} "
+                  f"{warm:>24}")
+
+
+if __name__ == "__main__":
+    main()
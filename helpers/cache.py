@@ -0,0 +1,93 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Content-addressed build cache
+
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+_HASHES = {}
+
+
+@contextmanager
+def atomic_write(filename: str):
+    """
+    Yields a temporary name (same folder and extension) to write to. The
+    file is moved to its final name only when the block finishes, so other
+    processes never see a partly written file.
+    """
+    root, ext = os.path.splitext(filename)
+    tmp = f"{root}.{os.getpid()}.{threading.get_ident()}.tmp{ext}"
+    try:
+        yield tmp
+        os.replace(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def file_hash(filename: str) -> str:
+    """
+    SHA1 of the file content. Hashes are remembered for the lifetime of
+    the process as long as mtime and size of the file do not change.
+    Missing files hash to 'missing'.
+    """
+    if not os.path.isfile(filename):
+        return "missing"
+    st = os.stat(filename)
+    key = (os.path.abspath(filename), st.st_mtime_ns, st.st_size)
+    if key not in _HASHES:
+        h = hashlib.sha1()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        _HASHES[key] = h.hexdigest()
+    return _HASHES[key]
+
+
+def content_key(*parts) -> str:
+    """
+    Key for any JSON serializable combination of parameters and file
+    hashes
+    """
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+class BuildCache:
+    """
+    Simple JSON manifest of target -> key. A target is up to date when its
+    key did not change and its output file(s) still exist.
+    """
+
+    def __init__(self, manifest: str):
+        self.manifest = manifest
+        self.entries = {}
+        if os.path.isfile(manifest):
+            with open(manifest) as f:
+                self.entries = json.load(f)
+
+    def is_fresh(self, target: str, key: str, outputs=()) -> bool:
+        entry = self.entries.get(target)
+        if entry is None or entry.get("key") != key:
+            return False
+        return all(os.path.isfile(x) for x in outputs)
+
+    def get(self, target: str, field: str, default=None):
+        return self.entries.get(target, {}).get(field, default)
+
+    def update(self, target: str, key: str, **fields):
+        self.entries[target] = {"key": key, **fields}
+
+    def save(self):
+        folder = os.path.dirname(self.manifest)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        with atomic_write(self.manifest) as tmp:
+            with open(tmp, "w") as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
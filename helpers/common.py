@@ -7,48 +7,75 @@
 #
 #  Common functions
 
-from collections import defaultdict
-import pandas as pd
+import os
+
 from helpers.constants import *
+from helpers.context import get_context
+from helpers.deindex import DE_FOLDER, get_de_index
+from helpers.fasta import FastaIndex, iter_fasta
+from helpers.genesets import GeneSet
+from helpers.trace import traced
 
 
-def get_genes(*, direction, condition, atlas, threshold=0, use_limit=None):
+def gene_file(*, direction, condition, atlas) -> str:
     condition = condition.strip().replace(" ", "_")
-    filename = f"mito/{direction}_{atlas}_{condition}.csv"
+    filename = f"{DE_FOLDER}/{direction}_{atlas}_{condition}.csv"
     if direction == "down" and atlas == "general":
-        filename = f"mito/up_general_{condition}.csv"
-    df = pd.read_csv(filename)
-    if "FDR" in df.columns:
-        df = df[df["FDR"] <= 0.05]
-    if "log2FC" in df.columns:
-        if use_limit is None:
-            if direction == "up":
-                df = df[df["log2FC"] >= threshold]
-            else:
-                df = df[df["log2FC"] <= threshold]
-        else:
-            df = df[df["log2FC"] >= use_limit[0]]
-            df = df[df["log2FC"] <= use_limit[1]]
-
-    return df["gene_id"].to_numpy()
+        filename = f"{DE_FOLDER}/up_general_{condition}.csv"
+    return filename
+
+
+@traced
+def get_genes(*, direction, condition, atlas, threshold=0, use_limit=None):
+    filename = gene_file(direction=direction, condition=condition,
+                         atlas=atlas)
+    table = get_de_index(os.path.dirname(filename)).table(filename)
+    return table.genes(direction, threshold=threshold, use_limit=use_limit)
+
+
+@traced
+def get_gene_set(*, direction, condition, atlas, threshold=0,
+                 use_limit=None) -> GeneSet:
+    """
+    Same as get_genes but returned as a bitset over the universe of the
+    DE index (see helpers.deindex)
+    """
+    filename = gene_file(direction=direction, condition=condition,
+                         atlas=atlas)
+    index = get_de_index(os.path.dirname(filename))
+    return index.gene_set(index.table(filename).genes(
+        direction, threshold=threshold, use_limit=use_limit))
 
 
+def get_utr_index(utr: int) -> FastaIndex:
+    """
+    Returns the memory-mapped, indexed reader for given UTR file. Index is
+    built only once per FASTA file and reused afterwards.
+
+    :param utr: 5 or 3
+    :return: FastaIndex of the UTR file
+    """
+    return get_context().utr(utr)
+
+
+@traced
 def extract_utr_sequence(utr: int) -> dict:
+    index = get_utr_index(utr)
+    return {k: index.sequence(k) for k in index}
+
+
+def iter_utr_sequence(utr: int, lengths_only=False, header=None):
+    """
+    Streams (transcript ID, sequence) of the UTR file without keeping the
+    whole file in memory. 'Sequence unavailable' entries are dropped.
+
+    :param utr: 5 or 3
+    :param lengths_only: Yield (transcript ID, length) instead
+    :param header: Optional custom header parser (see
+    helpers.fasta.header_field)
+    """
     if utr not in [5, 3]:
         raise Exception(f"UTR should be either 5 or 3. You have provided '"
                         f"{utr}'")
     filename = FILE_5UTR if utr == 5 else FILE_3UTR
-
-    with open(filename) as f:
-        lines = f.readlines()
-        seq = defaultdict(list)
-        current_id = None
-        for line in lines:
-            if line.strip().startswith(">"):
-                current_id = line.strip().split("|")[2]
-                continue
-            seq[current_id].append(line.strip())
-
-    seq = {k: "".join(v) for k, v in seq.items() if
-           v[0] != "Sequence unavailable"}
-    return seq
+    return iter_fasta(filename, header=header, lengths_only=lengths_only)
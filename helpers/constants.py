@@ -8,3 +8,14 @@
 FILE_5UTR = "data/utr5.fasta"
 FILE_3UTR = "data/utr3.fasta"
 FILE_MAPPING = "data/trans_to_gene.csv"
+
+# Release of Ensembl from which above files were exported
+ENSEMBL_RELEASE = 101
+
+# Folder for cached intermediate results (safe to delete)
+CACHE_FOLDER = "cache"
+
+# Folders added to PATH for the external motif tools
+MEME_PATH = ["/home/dex/Softwares/meme/bin",
+             "/home/dex/Softwares/meme/libexec/meme-5.2.0"]
+HOMER_PATH = ["/home/dex/Softwares/homer/bin"]
@@ -0,0 +1,131 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Process-wide cache of the annotation (BioMart) files
+
+import os
+
+import pandas as pd
+
+from helpers.constants import *
+from helpers.fasta import FastaIndex
+from helpers.trace import span
+from helpers.utrtable import UTRTable, load_utr_table
+
+COL_GENE = "Gene stable ID"
+COL_NAME = "Gene name"
+COL_TRANSCRIPT = "Transcript stable ID"
+COL_LENGTH = "Transcript length (including UTRs and CDS)"
+
+_CONTEXT = None
+
+
+def file_signature(*filenames) -> tuple:
+    """
+    Cheap signature of the files based on their modification time and
+    size. Missing files are part of the signature as well.
+    """
+    sig = []
+    for f in filenames:
+        if os.path.isfile(f):
+            st = os.stat(f)
+            sig.append((f, st.st_mtime_ns, st.st_size))
+        else:
+            sig.append((f, None, None))
+    return tuple(sig)
+
+
+class UTRContext:
+    """
+    Read-only view of the annotation shared by all analysis modules. It
+    holds the transcript -> gene mapping, the indexed UTR sequences and
+    the longest transcript (with available UTR) of every gene. Parts are
+    built on first use and never modified afterwards.
+    """
+
+    def __init__(self, signature: tuple):
+        self._signature = signature
+        self._mapping = None
+        self._t2g = None
+        self._utr = {}
+        self._longest = {}
+        self._table = {}
+
+    @property
+    def signature(self) -> tuple:
+        return self._signature
+
+    @property
+    def mapping(self) -> pd.DataFrame:
+        """Mapping table sorted by transcript length (longest first)"""
+        if self._mapping is None:
+            with span("helpers.context.mapping", file=FILE_MAPPING) as s:
+                df = pd.read_csv(FILE_MAPPING)
+                df = df.sort_values(by=COL_LENGTH, ascending=False,
+                                    kind="mergesort")
+                self._mapping = df
+                s["records"] = len(df)
+        return self._mapping
+
+    @property
+    def t2g(self) -> dict:
+        if self._t2g is None:
+            self._t2g = dict(zip(self.mapping[COL_TRANSCRIPT],
+                                 self.mapping[COL_GENE]))
+        return self._t2g
+
+    def utr(self, utr: int) -> FastaIndex:
+        if utr not in [5, 3]:
+            raise Exception(f"UTR should be either 5 or 3. You have "
+                            f"provided '{utr}'")
+        if utr not in self._utr:
+            filename = FILE_5UTR if utr == 5 else FILE_3UTR
+            self._utr[utr] = FastaIndex(filename)
+        return self._utr[utr]
+
+    def longest(self, utr: int) -> pd.DataFrame:
+        """
+        Longest transcript of every gene for which UTR sequence is
+        available.
+
+        :param utr: 5 or 3
+        :return: DataFrame indexed by gene ID with gene name and
+        transcript ID
+        """
+        if utr not in self._longest:
+            index = self.utr(utr)
+            df = self.mapping
+            with span("helpers.context.longest", utr=utr) as s:
+                df = df[df[COL_TRANSCRIPT].isin(list(index))]
+                df = df.drop_duplicates(subset=[COL_GENE])
+                df = df.set_index(COL_GENE)[[COL_NAME, COL_TRANSCRIPT]]
+                self._longest[utr] = df
+                s["records"] = len(df)
+        return self._longest[utr]
+
+    def table(self, utr: int) -> UTRTable:
+        """
+        Precomputed per-gene UTR table (see helpers.utrtable)
+        """
+        if utr not in self._table:
+            self._table[utr] = load_utr_table(self, utr)
+        return self._table[utr]
+
+
+def get_context() -> UTRContext:
+    """
+    Returns the shared context. It is rebuilt only when any of the
+    annotation files changed since it was created.
+    """
+    global _CONTEXT
+    sig = file_signature(FILE_MAPPING, FILE_5UTR, FILE_3UTR)
+    if _CONTEXT is None or _CONTEXT.signature != sig:
+        _CONTEXT = UTRContext(sig)
+    return _CONTEXT
+
+
+def invalidate_context():
+    global _CONTEXT
+    _CONTEXT = None
@@ -0,0 +1,96 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Index of the DE gene tables (mito/*.csv)
+
+import glob
+
+import numpy as np
+import pandas as pd
+
+from helpers.context import file_signature
+from helpers.genesets import GeneSet
+from helpers.trace import span
+
+DE_FOLDER = "mito"
+
+_INDEX = None
+
+
+class DETable:
+    """
+    Genes of one DE table which pass FDR <= 0.05, sorted by log2FC. Any
+    threshold or range is then a binary search.
+    """
+
+    def __init__(self, filename: str):
+        df = pd.read_csv(filename)
+        if "FDR" in df.columns:
+            df = df[df["FDR"] <= 0.05]
+        self.has_log2fc = "log2FC" in df.columns
+        if self.has_log2fc:
+            # NaN would sort last and fall into every 'up' range; the
+            # comparisons of the original filter excluded them
+            df = df[df["log2FC"].notna()]
+            df = df.sort_values(by="log2FC", kind="mergesort")
+            self.log2fc = df["log2FC"].to_numpy(dtype=float)
+        else:
+            self.log2fc = np.zeros(len(df))
+        self.gene_id = df["gene_id"].to_numpy(dtype=str)
+
+    def rows(self, direction, threshold=0, use_limit=None) -> slice:
+        if not self.has_log2fc:
+            return slice(0, len(self.gene_id))
+        if use_limit is not None:
+            return slice(np.searchsorted(self.log2fc, use_limit[0], "left"),
+                         np.searchsorted(self.log2fc, use_limit[1], "right"))
+        if direction == "up":
+            return slice(np.searchsorted(self.log2fc, threshold, "left"),
+                         len(self.log2fc))
+        return slice(0, np.searchsorted(self.log2fc, threshold, "right"))
+
+    def genes(self, direction, threshold=0, use_limit=None) -> np.ndarray:
+        return self.gene_id[self.rows(direction, threshold, use_limit)]
+
+
+class DEIndex:
+    """
+    All DE tables of the folder loaded once. Gene sets can be returned as
+    ID arrays or as bitsets (GeneSet) over the sorted universe of all
+    genes in these tables.
+    """
+
+    def __init__(self, folder=DE_FOLDER):
+        self.folder = folder
+        self.files = sorted(glob.glob(f"{folder}/*.csv"))
+        self.signature = file_signature(*self.files)
+        self.tables = {f: DETable(f) for f in self.files}
+        ids = [t.gene_id for t in self.tables.values()]
+        self.universe = np.unique(np.concatenate(
+            ids + [np.zeros(0, dtype=str)]))
+
+    def table(self, filename: str) -> DETable:
+        if filename not in self.tables:
+            raise FileNotFoundError(f"'{filename}' is not present in the "
+                                    f"DE folder '{self.folder}'")
+        return self.tables[filename]
+
+    def gene_set(self, genes) -> GeneSet:
+        """Bitset over the universe for given gene IDs"""
+        return GeneSet.from_genes(self.universe, genes)
+
+
+def get_de_index(folder=DE_FOLDER) -> DEIndex:
+    """
+    Shared DE index; rebuilt when any of the DE tables changed
+    """
+    global _INDEX
+    files = sorted(glob.glob(f"{folder}/*.csv"))
+    if (_INDEX is None or _INDEX.folder != folder or
+            _INDEX.signature != file_signature(*files)):
+        with span("helpers.deindex.DEIndex", folder=folder) as s:
+            _INDEX = DEIndex(folder)
+            s["records"] = len(_INDEX.universe)
+    return _INDEX
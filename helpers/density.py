@@ -0,0 +1,119 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Binned (FFT) kernel density estimation on fixed grids
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from helpers.trace import traced
+
+BINS = 4096  # Minimum number of bins used for the linear binning
+MAX_BINS = 1 << 20  # Above this, density is evaluated exactly
+BIN_WIDTH = 0.25  # Max. bin width as a fraction of the bandwidth
+EXACT_CHUNK = 1 << 22  # Max. elements of one exact evaluation block
+CACHE_SIZE = 512  # Number of densities kept in memory
+
+_CACHE = OrderedDict()
+
+
+def scott_bandwidth(values: np.ndarray) -> float:
+    """Same bandwidth as scipy.stats.gaussian_kde with default settings"""
+    return float(np.std(values, ddof=1) * len(values) ** (-1 / 5))
+
+
+def _exact_kde(values: np.ndarray, grid: np.ndarray, bw: float):
+    density = np.zeros(len(grid))
+    rows = max(1, EXACT_CHUNK // len(grid))
+    for start in range(0, len(values), rows):
+        z = (grid[None, :] - values[start:start + rows, None]) / bw
+        density += np.exp(-0.5 * z ** 2).sum(axis=0)
+    return density / (len(values) * bw * np.sqrt(2 * np.pi))
+
+
+def _binned_kde(values: np.ndarray, grid: np.ndarray, bw: float):
+    lo = grid[0] - 4 * bw
+    hi = grid[-1] + 4 * bw
+    # Bins have to be narrow compared to the bandwidth, otherwise the
+    # kernel is sampled at just a few points
+    bins = max(BINS, int(np.ceil((hi - lo) / (BIN_WIDTH * bw))) + 1)
+    if bins > MAX_BINS:
+        return _exact_kde(values, grid, bw)
+    step = (hi - lo) / (bins - 1)
+    # Linear binning: every point is split between its two nearest bins.
+    # Points far outside the grid do not contribute, but still count in
+    # the normalisation (as in the exact KDE).
+    pos = (values - lo) / step
+    inside = (pos >= 0) & (pos < bins - 1)
+    pos = pos[inside]
+    left = np.floor(pos).astype(np.int64)
+    frac = pos - left
+    counts = np.bincount(left, weights=1 - frac, minlength=bins)
+    counts += np.bincount(left + 1, weights=frac, minlength=bins)[:bins]
+
+    half = min(bins - 1, int(np.ceil(4 * bw / step)))
+    offsets = np.arange(-half, half + 1) * step
+    # Discrete kernel sums to one, so the total mass is kept exactly
+    kernel = np.exp(-0.5 * (offsets / bw) ** 2)
+    kernel /= kernel.sum()
+    size = bins + len(kernel) - 1
+    fft_size = 1 << int(np.ceil(np.log2(size)))
+    conv = np.fft.irfft(np.fft.rfft(counts, fft_size) *
+                        np.fft.rfft(kernel, fft_size), fft_size)
+    density = conv[half:half + bins] / (len(values) * step)
+    return np.interp(grid, lo + np.arange(bins) * step, density)
+
+
+@traced
+def kde(values, grid) -> np.ndarray:
+    """
+    Gaussian KDE (Scott's bandwidth) of the values evaluated on the grid.
+    Values are binned and convolved with FFT, so cost does not depend on
+    the grid size times number of values. Results are cached per set of
+    values and grid.
+
+    :param values: Sample (e.g. UTR lengths of a gene set)
+    :param grid: Evenly or unevenly spaced, increasing evaluation points
+    :return: Density on the grid
+    """
+    values = np.sort(np.asarray(values, dtype=np.float64))
+    grid = np.asarray(grid, dtype=np.float64)
+    if len(values) < 2 or values[0] == values[-1]:
+        raise ValueError("At least two distinct values are needed for KDE")
+    if len(grid) == 0:
+        return np.zeros(0)
+    key = (hashlib.sha1(values.tobytes()).hexdigest(),
+           hashlib.sha1(grid.tobytes()).hexdigest())
+    if key in _CACHE:
+        _CACHE.move_to_end(key)
+        return _CACHE[key].copy()
+    density = _binned_kde(values, grid, scott_bandwidth(values))
+    _CACHE[key] = density
+    if len(_CACHE) > CACHE_SIZE:
+        _CACHE.popitem(last=False)
+    return density.copy()
+
+
+def violin_stats(values, points=100, quantiles=None) -> dict:
+    """
+    Statistics needed by matplotlib's Axes.violin. Density is calculated
+    with kde on the same grid as matplotlib's violinplot (min to max,
+    100 points by default as in Axes.violinplot).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    coords = np.linspace(values.min(), values.max(), points)
+    stats = {
+        "coords": coords,
+        "vals": kde(values, coords),
+        "mean": np.mean(values),
+        "median": np.median(values),
+        "min": np.min(values),
+        "max": np.max(values),
+    }
+    if quantiles is not None:
+        stats["quantiles"] = np.quantile(values, quantiles)
+    return stats
@@ -3,10 +3,9 @@
 #
 #  UTR Analysis and related statistics
 
-import pygraphviz as pgv
-
 
 def draw_method():
+    import pygraphviz as pgv
     graph = pgv.AGraph(directed=True)
 
     node_mapping = {
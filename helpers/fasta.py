@@ -0,0 +1,226 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Indexed (faidx-style) access to the BioMart FASTA files
+
+import mmap
+import os
+
+from helpers.cache import atomic_write
+from helpers.trace import traced
+
+INDEX_SUFFIX = ".fai"
+UNAVAILABLE = b"Sequence unavailable"
+
+
+def header_field(index=2, sep="|"):
+    """
+    Header parser which returns given field of the separated header. With
+    index=None, full header (without '>') is used as an ID.
+    """
+
+    def _parse(header: str) -> str:
+        if index is None:
+            return header
+        return header.split(sep)[index]
+
+    return _parse
+
+
+def _header_id(line: bytes, header_index: int) -> str:
+    return header_field(header_index)(line[1:].strip().decode())
+
+
+def iter_fasta(filename: str, header=None, lengths_only=False,
+               chunk_size=1 << 20, skip_unavailable=True):
+    """
+    Streams the FASTA file record by record. Only the record being
+    assembled is kept in memory, the file itself is read in chunks of
+    given size.
+
+    :param filename: FASTA file
+    :param header: Function which converts header line (without '>') to
+    record ID. Default is the third '|' separated field (BioMart
+    transcript ID)
+    :param lengths_only: If True, yields (id, length) instead of the
+    sequence
+    :param chunk_size: Number of bytes read at once
+    :param skip_unavailable: Drop 'Sequence unavailable' records
+    :return: generator of (id, sequence) or (id, length)
+    """
+    if header is None:
+        header = header_field(2)
+    unavailable = UNAVAILABLE.decode()
+
+    def _emit(rid, parts, length, first):
+        if rid is None:
+            return None
+        if skip_unavailable and first == unavailable:
+            return None
+        if lengths_only:
+            return rid, length
+        return rid, "".join(parts)
+
+    rid, parts, length, first = None, [], 0, None
+    with open(filename, "r", buffering=chunk_size) as f:
+        while True:
+            lines = f.readlines(chunk_size)
+            if not lines:
+                break
+            for line in lines:
+                line = line.strip()
+                if line.startswith(">"):
+                    record = _emit(rid, parts, length, first)
+                    if record is not None:
+                        yield record
+                    rid, parts, length, first = header(line[1:]), [], 0, None
+                    continue
+                if first is None:
+                    first = line
+                length += len(line)
+                if not lengths_only:
+                    parts.append(line)
+    record = _emit(rid, parts, length, first)
+    if record is not None:
+        yield record
+
+
+@traced
+def build_index(filename: str, header_index=2) -> str:
+    """
+    Scans the FASTA file once and writes a faidx-style index next to it.
+    Each row holds transcript ID, sequence length, byte offset of the
+    first base, bases per line and bytes per line. Records with
+    'Sequence unavailable' are not indexed.
+
+    :param filename: FASTA file downloaded from BioMart
+    :param header_index: Position of transcript ID in the '|' separated
+    header
+    :return: Name of the index file
+    """
+    rows = []
+    current = None
+
+    def _close(record):
+        if record is None or record[4] == UNAVAILABLE:
+            return
+        name, offset, line_bases, line_width, _, length, widths = record
+        # faidx requires all lines except the last one to have same width
+        if any(w != line_bases for w in widths[:-1]) or (
+                len(widths) > 0 and widths[-1] > line_bases):
+            raise ValueError(f"Irregular line length in '{name}' of "
+                             f"'{filename}'. File can not be indexed.")
+        rows.append((name, length, offset, line_bases, line_width))
+
+    with open(filename, "rb") as f:
+        position = 0
+        for line in f:
+            if line.startswith(b">"):
+                _close(current)
+                current = [_header_id(line, header_index),
+                           position + len(line), 0, 0, None, 0, []]
+            elif current is not None:
+                bases = line.rstrip(b"\r\n")
+                if current[4] is None:
+                    current[2] = len(bases)
+                    current[3] = len(line)
+                    current[4] = bases
+                if len(bases) > 0:
+                    current[5] += len(bases)
+                    current[6].append(len(bases))
+            position += len(line)
+        _close(current)
+
+    # Written under a temporary name, so readers never see a partial
+    # index which is newer than the FASTA file
+    index_file = filename + INDEX_SUFFIX
+    with atomic_write(index_file) as tmp:
+        with open(tmp, "w") as f:
+            for row in rows:
+                print("\t".join(str(x) for x in row), file=f)
+    return index_file
+
+
+@traced
+def load_index(filename: str, header_index=2) -> dict:
+    """
+    Loads the index for given FASTA file. Index is (re)built if it is
+    missing or older than the FASTA file itself.
+
+    :param filename: FASTA file
+    :param header_index: Position of transcript ID in the header
+    :return: dict of transcript ID -> (length, offset, line bases,
+    line width)
+    """
+    index_file = filename + INDEX_SUFFIX
+    if (not os.path.isfile(index_file) or
+            os.path.getmtime(index_file) < os.path.getmtime(filename)):
+        build_index(filename, header_index=header_index)
+    index = {}
+    with open(index_file) as f:
+        for line in f:
+            name, *values = line.rstrip("\n").split("\t")
+            index[name] = tuple(int(x) for x in values)
+    return index
+
+
+class FastaIndex:
+    """
+    Memory-mapped reader for the indexed FASTA file. Only the bytes of
+    the requested transcript are touched, lengths come directly from the
+    index without reading the file.
+    """
+
+    def __init__(self, filename: str, header_index=2):
+        self.filename = filename
+        self.header_index = header_index
+        self.index = load_index(filename, header_index=header_index)
+        self._file = None
+        self._map = None
+
+    def __getstate__(self):
+        # mmap objects can not be pickled, reopen lazily in the new process
+        state = self.__dict__.copy()
+        state["_file"] = None
+        state["_map"] = None
+        return state
+
+    def __contains__(self, item):
+        return item in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def _mapped(self) -> mmap.mmap:
+        if self._map is None:
+            self._file = open(self.filename, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        return self._map
+
+    def length(self, transcript: str) -> int:
+        return self.index[transcript][0]
+
+    def lengths(self) -> dict:
+        return {k: v[0] for k, v in self.index.items()}
+
+    def sequence(self, transcript: str) -> str:
+        length, offset, line_bases, line_width = self.index[transcript]
+        if length == 0:
+            return ""
+        full_lines = (length - 1) // line_bases
+        end = offset + length + full_lines * (line_width - line_bases)
+        raw = self._mapped()[offset:end]
+        return raw.replace(b"\n", b"").replace(b"\r", b"").decode()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+        self._map = None
+        self._file = None
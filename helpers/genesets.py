@@ -0,0 +1,109 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Bitset based gene sets over a fixed gene universe
+
+import numpy as np
+
+_POPCOUNT = np.array([bin(x).count("1") for x in range(256)],
+                     dtype=np.int64)
+MAX_SETS = 16  # Sets compared at once (UpSet / Venn regions)
+
+
+class GeneSet:
+    """
+    Set of genes stored as packed bits (one bit per gene of the sorted
+    universe). Sets over the same universe support &, |, - , ^ and ~
+    with NumPy byte-wise operations; len() is a popcount.
+    """
+
+    __slots__ = ["universe", "bits"]
+
+    def __init__(self, universe: np.ndarray, bits: np.ndarray):
+        self.universe = universe
+        self.bits = bits
+
+    @classmethod
+    def from_mask(cls, universe, mask):
+        return cls(universe, np.packbits(np.asarray(mask, dtype=bool)))
+
+    @classmethod
+    def from_genes(cls, universe, genes):
+        """Genes not present in the universe are ignored"""
+        genes = np.asarray(genes, dtype=universe.dtype)
+        mask = np.zeros(len(universe), dtype=bool)
+        if len(universe) > 0 and len(genes) > 0:
+            pos = np.searchsorted(universe, genes)
+            pos[pos == len(universe)] = 0
+            mask[pos[universe[pos] == genes]] = True
+        return cls.from_mask(universe, mask)
+
+    def _check(self, other):
+        if self.universe is not other.universe and not np.array_equal(
+                self.universe, other.universe):
+            raise ValueError("Gene sets are defined on different "
+                             "universes")
+
+    def __and__(self, other):
+        self._check(other)
+        return GeneSet(self.universe, self.bits & other.bits)
+
+    def __or__(self, other):
+        self._check(other)
+        return GeneSet(self.universe, self.bits | other.bits)
+
+    def __sub__(self, other):
+        self._check(other)
+        return GeneSet(self.universe, self.bits & ~other.bits)
+
+    def __xor__(self, other):
+        self._check(other)
+        return GeneSet(self.universe, self.bits ^ other.bits)
+
+    def __invert__(self):
+        # Padding bits of the last byte have to stay empty
+        return GeneSet.from_mask(self.universe, ~self.mask())
+
+    def __eq__(self, other):
+        return (isinstance(other, GeneSet) and
+                np.array_equal(self.universe, other.universe) and
+                np.array_equal(self.bits, other.bits))
+
+    def __len__(self):
+        return int(_POPCOUNT[self.bits].sum())
+
+    def mask(self) -> np.ndarray:
+        return np.unpackbits(self.bits, count=len(self.universe)).astype(
+            bool)
+
+    def genes(self) -> np.ndarray:
+        return self.universe[self.mask()]
+
+
+def membership(sets: list) -> np.ndarray:
+    """
+    Region code of every gene of the universe: bit i is set when gene is
+    present in sets[i]. Supports up to MAX_SETS sets.
+    """
+    if len(sets) > MAX_SETS:
+        raise ValueError(f"At most {MAX_SETS} sets are supported. You "
+                         f"have provided {len(sets)}")
+    code = np.zeros(len(sets[0].universe), dtype=np.uint32)
+    for i, s in enumerate(sets):
+        sets[0]._check(s)
+        code |= s.mask().astype(np.uint32) << np.uint32(i)
+    return code
+
+
+def region_sizes(code: np.ndarray) -> tuple:
+    """
+    Sizes of the non-empty exclusive regions (UpSet / Venn). Only regions
+    which occur are counted, so cost does not grow with 2^n.
+
+    :param code: Region code of every gene (see membership); region 0
+    holds genes present in none of the sets
+    :return: (sorted region codes, number of genes in every region)
+    """
+    return np.unique(code, return_counts=True)
@@ -0,0 +1,129 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Concurrent runner for external tools (STREME, HOMER etc.)
+
+import os
+import subprocess
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from helpers.trace import span
+
+LOG_FOLDER = "logs"
+
+
+class Job:
+    """
+    Single external command.
+
+    :param name: Unique name, also used for the log files
+    :param command: Command as a list of arguments
+    :param threads: Number of CPUs this command uses
+    :param complete: Path (file or folder) which exists only when the job
+    has finished successfully earlier. Such jobs are skipped.
+    :param env: Environment for the command
+    :param timeout: Timeout in seconds for a single attempt
+    :param retries: Number of extra attempts after failure or timeout
+    """
+
+    def __init__(self, name, command, *, threads=1, complete=None, env=None,
+                 timeout=None, retries=0):
+        self.name = name
+        self.command = command
+        self.threads = threads
+        self.complete = complete
+        self.env = env
+        self.timeout = timeout
+        self.retries = retries
+
+    def is_complete(self) -> bool:
+        return self.complete is not None and os.path.exists(self.complete)
+
+    def run(self, log_folder=LOG_FOLDER) -> int:
+        """
+        Runs the command with stdout and stderr written to the
+        '<log_folder>/<name>.out' and '.err'
+
+        :return: Return code of the last attempt (-1 for timeout or when
+        the command could not be started)
+        """
+        code = -1
+        for attempt in range(self.retries + 1):
+            with span(self.name, category="job", attempt=attempt + 1,
+                      threads=self.threads) as s:
+                code = self._attempt(attempt, log_folder)
+                s["returncode"] = code
+            if code == 0:
+                break
+        return code
+
+    def _attempt(self, attempt: int, log_folder: str) -> int:
+        mode = "w" if attempt == 0 else "a"
+        with open(f"{log_folder}/{self.name}.out", mode) as out, \
+                open(f"{log_folder}/{self.name}.err", mode) as err:
+            print(f"# attempt {attempt + 1}: {' '.join(self.command)}",
+                  file=err, flush=True)
+            try:
+                return subprocess.run(self.command, env=self.env,
+                                      stdout=out, stderr=err,
+                                      timeout=self.timeout).returncode
+            except subprocess.TimeoutExpired:
+                print(f"# timeout after {self.timeout} s", file=err)
+                return -1
+            except OSError as e:
+                # e.g. missing executable; counts as a failed attempt
+                print(f"# could not start: {e}", file=err)
+                return -1
+
+
+def run_jobs(jobs: list, cpus=None, log_folder=LOG_FOLDER) -> dict:
+    """
+    Runs jobs concurrently such that total threads of running jobs do not
+    exceed the CPU budget. Jobs are started in the given order whenever
+    enough CPUs are free.
+
+    :param jobs: List of Job
+    :param cpus: CPU budget (default: all CPUs)
+    :param log_folder: Folder for stdout/stderr logs
+    :return: dict of job name -> return code (None for skipped jobs)
+    """
+    if cpus is None:
+        cpus = os.cpu_count() or 1
+    if not os.path.isdir(log_folder):
+        os.makedirs(log_folder)
+
+    results = {}
+    pending = []
+    for job in jobs:
+        if job.is_complete():
+            print(f"Skipped {job.name} : output already exists")
+            results[job.name] = None
+        else:
+            job.threads = max(1, min(job.threads, cpus))
+            pending.append(job)
+
+    free = cpus
+    running = {}
+    with ThreadPoolExecutor(max_workers=cpus) as pool:
+        while pending or running:
+            for job in [x for x in pending]:
+                if job.threads <= free:
+                    pending.remove(job)
+                    free -= job.threads
+                    running[pool.submit(job.run, log_folder)] = job
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                free += job.threads
+                try:
+                    results[job.name] = future.result()
+                except Exception as e:
+                    # Unexpected error of one job must not lose the others
+                    print(f"Error in {job.name}: {e}")
+                    results[job.name] = -1
+                if results[job.name] != 0:
+                    print(f"Failed {job.name} (code {results[job.name]}), "
+                          f"see {log_folder}/{job.name}.err")
+    return results
@@ -0,0 +1,177 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  2-bit packed storage of nucleotide sequences
+
+import numpy as np
+
+BASES = "ACGT"
+AMBIGUOUS = 4  # Code used for N and other IUPAC letters after unpacking
+
+_ENCODE = np.full(256, AMBIGUOUS, dtype=np.uint8)
+for _i, _b in enumerate(BASES):
+    _ENCODE[ord(_b)] = _i
+    _ENCODE[ord(_b.lower())] = _i
+_ENCODE[ord("U")] = 3
+_ENCODE[ord("u")] = 3
+_DECODE = np.frombuffer(b"ACGTN", dtype=np.uint8)
+_SHIFTS = np.array([6, 4, 2, 0], dtype=np.uint8)
+
+
+def encode(sequence: str):
+    """
+    :param sequence: Nucleotide sequence
+    :return: (codes 0-3 with 4 for non-ACGT, positions of non-ACGT
+    letters, those letters as bytes)
+    """
+    raw = np.frombuffer(sequence.encode(), dtype=np.uint8)
+    codes = _ENCODE[raw]
+    positions = np.flatnonzero(codes == AMBIGUOUS)
+    return codes, positions, raw[positions]
+
+
+def pack(codes: np.ndarray) -> np.ndarray:
+    """Packs 2-bit codes four per byte (ambiguous letters are stored as A)"""
+    codes = np.where(codes == AMBIGUOUS, 0, codes).astype(np.uint8)
+    pad = (-len(codes)) % 4
+    if pad:
+        codes = np.concatenate([codes, np.zeros(pad, dtype=np.uint8)])
+    codes = codes.reshape(-1, 4)
+    return ((codes[:, 0] << 6) | (codes[:, 1] << 4) |
+            (codes[:, 2] << 2) | codes[:, 3]).astype(np.uint8)
+
+
+def unpack(packed: np.ndarray, start: int, stop: int) -> np.ndarray:
+    """Codes of the bases [start, stop) of the packed array"""
+    if stop <= start:
+        return np.zeros(0, dtype=np.uint8)
+    chunk = packed[start // 4:(stop - 1) // 4 + 1]
+    codes = ((chunk[:, None] >> _SHIFTS) & 3).ravel()
+    offset = start - (start // 4) * 4
+    return codes[offset:offset + stop - start]
+
+
+class PackedSequences:
+    """
+    Collection of sequences stored with 2 bits per base in a single NumPy
+    array. Every sequence starts at a byte boundary. Non-ACGT letters (N
+    and other IUPAC codes) are kept in a side mask of positions and
+    original letters. A, C, G and T are restored in upper case and U is
+    packed as T, so RNA sequences come back as DNA.
+    """
+
+    def __init__(self, ids, lengths, byte_offsets, packed, mask_offsets,
+                 mask_positions, mask_letters):
+        self.ids = list(ids)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.byte_offsets = np.asarray(byte_offsets, dtype=np.int64)
+        self.packed = packed
+        self.mask_offsets = np.asarray(mask_offsets, dtype=np.int64)
+        self.mask_positions = mask_positions
+        self.mask_letters = mask_letters
+        self._rows = {k: i for i, k in enumerate(self.ids)}
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        :param records: Iterable of (id, sequence), e.g. from
+        helpers.fasta.iter_fasta. Sequences are packed one at a time.
+        """
+        ids, lengths, byte_offsets, chunks = [], [], [0], []
+        mask_offsets, positions, letters = [0], [], []
+        for rid, seq in records:
+            codes, pos, let = encode(seq)
+            ids.append(rid)
+            lengths.append(len(codes))
+            chunk = pack(codes)
+            chunks.append(chunk)
+            byte_offsets.append(byte_offsets[-1] + len(chunk))
+            positions.append(pos.astype(np.int32))
+            letters.append(let)
+            mask_offsets.append(mask_offsets[-1] + len(pos))
+
+        def _join(arrays, dtype):
+            if len(arrays) == 0:
+                return np.zeros(0, dtype=dtype)
+            return np.concatenate(arrays).astype(dtype)
+
+        return cls(ids, lengths, byte_offsets[:-1],
+                   _join(chunks, np.uint8), mask_offsets,
+                   _join(positions, np.int32), _join(letters, np.uint8))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, item):
+        return item in self._rows
+
+    @property
+    def nbytes(self) -> int:
+        return (self.packed.nbytes + self.mask_positions.nbytes +
+                self.mask_letters.nbytes + self.lengths.nbytes +
+                self.byte_offsets.nbytes + self.mask_offsets.nbytes)
+
+    def length(self, rid) -> int:
+        return int(self.lengths[self._rows[rid]])
+
+    def codes(self, rid, start=None, stop=None) -> np.ndarray:
+        """
+        Unpacked codes (0-3 for ACGT, 4 for anything else) of the sequence
+        slice. Only the bytes of the slice are unpacked.
+        """
+        return self._codes(self._rows[rid], start, stop)
+
+    def _codes(self, row, start=None, stop=None) -> np.ndarray:
+        start, stop, _ = slice(start, stop).indices(int(self.lengths[row]))
+        base = int(self.byte_offsets[row]) * 4
+        codes = unpack(self.packed, base + start, base + stop)
+        pos = self._mask(row)[0]
+        pos = pos[(pos >= start) & (pos < stop)]
+        codes[pos - start] = AMBIGUOUS
+        return codes
+
+    def _mask(self, row):
+        a, b = self.mask_offsets[row], self.mask_offsets[row + 1]
+        return self.mask_positions[a:b], self.mask_letters[a:b]
+
+    def sequence(self, rid, start=None, stop=None) -> str:
+        row = self._rows[rid]
+        start, stop, _ = slice(start, stop).indices(int(self.lengths[row]))
+        letters = _DECODE[self.codes(rid, start, stop)]
+        pos, let = self._mask(row)
+        keep = (pos >= start) & (pos < stop)
+        letters[pos[keep] - start] = let[keep]
+        return letters.tobytes().decode()
+
+    def kmers(self, rid, k: int) -> np.ndarray:
+        """
+        Integer encoded k-mers (base 4, first base most significant) of
+        the sequence. Windows containing ambiguous letters are skipped.
+
+        :param rid: Sequence ID
+        :param k: k-mer length (up to 32)
+        """
+        return self._kmers(self._rows[rid], k)
+
+    def iter_kmers(self, k: int):
+        """
+        k-mers of every stored sequence (in the order of insertion,
+        duplicated IDs included)
+        """
+        for row in range(len(self.ids)):
+            yield self._kmers(row, k)
+
+    def _kmers(self, row, k: int) -> np.ndarray:
+        if not 0 < k <= 32:
+            raise ValueError(f"k should be between 1 and 32, not {k}")
+        codes = self._codes(row)
+        if len(codes) < k:
+            return np.zeros(0, dtype=np.uint64)
+        windows = np.lib.stride_tricks.sliding_window_view(codes, k)
+        bad = np.convolve(codes == AMBIGUOUS, np.ones(k, dtype=int),
+                          mode="valid") > 0
+        windows = windows[~bad].astype(np.uint64)
+        powers = np.uint64(4) ** np.arange(k - 1, -1, -1, dtype=np.uint64)
+        return (windows * powers).sum(axis=1, dtype=np.uint64)
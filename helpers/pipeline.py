@@ -0,0 +1,253 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Declarative pipeline: stages from a TOML / YAML config run as a DAG
+
+import importlib
+import inspect
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# Stage type -> function which runs it. Modules are imported only when a
+# stage of that type actually runs.
+STAGE_TYPES = {
+    "utr_sweep": "analysis.utr:generate_combinations",
+    "utr_violin": "analysis.utr:violin_plots",
+    "pca": "analysis.statistics:run_pca",
+    "clustering": "analysis.statistics:run_clustering",
+    "ma_plot": "analysis.statistics:plot_ma",
+    "box_whisker": "analysis.statistics:plot_box_whisker",
+    "enrichment": "analysis.deseq2:go_enrichment_analysis",
+    "map_terms": "analysis.deseq2:map_terms",
+    "term_network": "analysis.deseq2:plot_network",
+    "fasta": "analysis.meme:generate_all",
+    "streme": "analysis.meme:run_streme",
+    "homer": "analysis.homer:run_homer",
+    "fastqc": "analysis.multiqc:plot_fastqc",
+    "sortmerna": "analysis.multiqc:plot_sortmerna",
+    "star": "analysis.multiqc:plot_star",
+}
+
+# Stage types which draw a figure. Its file is the 'output' param, which
+# defaults to '<stage name>.png' so that stages do not overwrite each other
+PLOT_STAGES = {"utr_violin", "pca", "clustering", "ma_plot", "box_whisker",
+               "map_terms", "term_network", "fastqc", "sortmerna", "star"}
+
+# Files written by every stage of the type irrespective of its params
+FIXED_OUTPUTS = {"utr_sweep": ["figs.tex"]}
+
+
+class Stage:
+    """
+    :param name: Unique name of the stage in the config
+    :param kind: One of STAGE_TYPES
+    :param params: Keyword arguments of the stage function
+    :param after: Names of stages which have to finish first
+    """
+
+    def __init__(self, name, kind, params=None, after=None):
+        if kind not in STAGE_TYPES:
+            raise ValueError(f"Stage '{name}' has unknown type '{kind}'. "
+                             f"Available: {', '.join(sorted(STAGE_TYPES))}")
+        self.name = name
+        self.kind = kind
+        self.params = dict(params or {})
+        self.after = list(after or [])
+        if kind in PLOT_STAGES:
+            self.params.setdefault("output", f"{name}.png")
+
+    def outputs(self) -> list:
+        """Files written by the stage"""
+        files = list(FIXED_OUTPUTS.get(self.kind, []))
+        if self.kind in PLOT_STAGES:
+            files.append(self.params["output"])
+        return [os.path.normpath(x) for x in files]
+
+
+def load_config(filename: str) -> dict:
+    """
+    Reads TOML (.toml) or YAML (.yml / .yaml) config. Format:
+
+        [settings]
+        workers = 4           # stages running at the same time
+
+        [stages.sweep]
+        type = "utr_sweep"
+        workers = 8           # everything else goes to the function
+
+        [stages.motifs]
+        type = "streme"
+        after = ["fasta"]
+
+        [stages.ma]
+        type = "ma_plot"
+        filename = "de.csv"
+        output = "ma.png"     # figures default to '<stage name>.png'
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in [".yml", ".yaml"]:
+        import yaml
+        with open(filename) as f:
+            return yaml.safe_load(f) or {}
+    import tomllib
+    with open(filename, "rb") as f:
+        return tomllib.load(f)
+
+
+def parse_stages(config: dict) -> dict:
+    stages = {}
+    for name, value in (config.get("stages") or {}).items():
+        value = dict(value)
+        kind = value.pop("type", name)
+        after = value.pop("after", [])
+        stages[name] = Stage(name, kind, value, after)
+    return stages
+
+
+def execution_order(stages: dict) -> list:
+    """
+    Topological order of the stages. Raises ValueError for missing
+    dependencies or cycles.
+    """
+    for s in stages.values():
+        missing = [x for x in s.after if x not in stages]
+        if missing:
+            raise ValueError(f"Stage '{s.name}' depends on unknown "
+                             f"stage(s): {', '.join(missing)}")
+    order = []
+    state = {}
+
+    def _visit(name, path):
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError(f"Cycle in stages: {' -> '.join(path)}")
+        state[name] = "visiting"
+        for dep in stages[name].after:
+            _visit(dep, path + [dep])
+        state[name] = "done"
+        order.append(name)
+
+    for name in stages:
+        _visit(name, [name])
+    return order
+
+
+def stage_function(kind: str):
+    module, function = STAGE_TYPES[kind].split(":")
+    return getattr(importlib.import_module(module), function)
+
+
+def check_params(stages: dict, names: list):
+    """
+    Raises ValueError when params of any stage do not match the signature
+    of its function
+    """
+    for name in names:
+        s = stages[name]
+        try:
+            inspect.signature(stage_function(s.kind)).bind(**s.params)
+        except TypeError as e:
+            raise ValueError(f"Invalid params of stage '{name}' "
+                             f"({s.kind}): {e}") from None
+
+
+def check_outputs(stages: dict, names: list):
+    """Raises ValueError when two stages write the same file"""
+    writers = {}
+    for name in names:
+        for filename in stages[name].outputs():
+            if filename in writers:
+                raise ValueError(f"Stages '{writers[filename]}' and "
+                                 f"'{name}' both write '{filename}'")
+            writers[filename] = name
+
+
+def run_stage(kind: str, params: dict):
+    return stage_function(kind)(**params)
+
+
+def prepare_shared_inputs():
+    """
+    Builds on-disk caches used by many stages (UTR FASTA indexes and the
+    3'UTR table) once in this process, before stages start in parallel
+    """
+    from helpers.constants import FILE_3UTR, FILE_5UTR, FILE_MAPPING
+    from helpers.context import get_context
+    ctx = get_context()
+    for utr, filename in [(5, FILE_5UTR), (3, FILE_3UTR)]:
+        if os.path.isfile(filename):
+            ctx.utr(utr)
+    if os.path.isfile(FILE_3UTR) and os.path.isfile(FILE_MAPPING):
+        ctx.table(3)
+
+
+def run_pipeline(config: dict, workers=None, only=None, dry_run=False):
+    """
+    Runs all stages of the config. Stages whose dependencies are finished
+    run concurrently, each in its own process. Intermediate inputs (UTR
+    table, DE index, expression matrix etc.) are shared through their
+    on-disk caches, which are built once before any stage starts (see
+    prepare_shared_inputs) and are always written atomically.
+
+    :param config: Parsed config (see load_config)
+    :param workers: Number of stages running at the same time (default:
+    'workers' from [settings] or 1)
+    :param only: Optional list of stages to run (with their dependencies)
+    :param dry_run: Only print the execution order
+    :return: dict of stage name -> returned value
+    """
+    stages = parse_stages(config)
+    order = execution_order(stages)
+    if only:
+        needed = set()
+
+        def _mark(name):
+            if name not in stages:
+                raise ValueError(f"Unknown stage '{name}'")
+            if name not in needed:
+                needed.add(name)
+                for dep in stages[name].after:
+                    _mark(dep)
+
+        for x in only:
+            _mark(x)
+        order = [x for x in order if x in needed]
+    check_params(stages, order)
+    check_outputs(stages, order)
+    if dry_run:
+        for name in order:
+            s = stages[name]
+            after = f" (after {', '.join(s.after)})" if s.after else ""
+            print(f"{name} : {s.kind}{after}")
+        return {}
+
+    if workers is None:
+        workers = (config.get("settings") or {}).get("workers", 1)
+    if not isinstance(workers, int) or workers < 1:
+        raise ValueError(f"'workers' should be a positive integer. You "
+                         f"have provided '{workers}'")
+    prepare_shared_inputs()
+    results = {}
+    pending = list(order)
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            for name in [x for x in pending]:
+                deps = [x for x in stages[name].after if x in pending or
+                        x in running.values()]
+                if len(deps) == 0 and len(running) < workers:
+                    pending.remove(name)
+                    print(f"Started {name}")
+                    future = pool.submit(run_stage, stages[name].kind,
+                                         stages[name].params)
+                    running[future] = name
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                # Failure of any stage stops the pipeline
+                results[name] = future.result()
+                print(f"Finished {name}")
+    return results
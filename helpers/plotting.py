@@ -0,0 +1,72 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Plotting setup. matplotlib and SecretColors are imported only when the
+#  first plot is drawn, so that non-plotting stages start quickly.
+#
+#  Font is set only by modules which ask for it (statistics and DESeq2
+#  figures use FONT); other figures keep the matplotlib default.
+#
+#  Set UTR_HEADLESS=1 to always use the non-interactive Agg backend (e.g.
+#  on cluster nodes without display).
+
+import os
+
+HEADLESS_ENV = "UTR_HEADLESS"
+FONT = "IBM Plex Sans"
+
+_STATE = {}
+
+
+def is_headless() -> bool:
+    return os.environ.get(HEADLESS_ENV, "").lower() not in ["", "0",
+                                                            "false"]
+
+
+def setup_matplotlib(font=None):
+    """
+    Imports matplotlib and sets its backend once
+    :param font: Optional font family set for all following figures
+    :return: matplotlib module
+    """
+    if "matplotlib" not in _STATE:
+        import matplotlib
+        if is_headless():
+            matplotlib.use("Agg")
+        _STATE["matplotlib"] = matplotlib
+    if font is not None:
+        _STATE["matplotlib"].rc("font", family=font)
+    return _STATE["matplotlib"]
+
+
+def pyplot(font=None):
+    """
+    :param font: Optional font family (see setup_matplotlib)
+    :return: Configured matplotlib.pyplot
+    """
+    setup_matplotlib(font)
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def palette():
+    """
+    :return: Shared SecretColors Palette
+    """
+    if "palette" not in _STATE:
+        from SecretColors import Palette
+        _STATE["palette"] = Palette()
+    return _STATE["palette"]
+
+
+def figure(font=None, **kwargs):
+    """
+    New matplotlib Figure which does not use pyplot state (safe to use in
+    worker processes)
+    :param font: Optional font family (see setup_matplotlib)
+    """
+    setup_matplotlib(font)
+    from matplotlib.figure import Figure
+    return Figure(**kwargs)
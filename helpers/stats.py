@@ -0,0 +1,22 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Statistical helpers shared by the enrichment analyses
+
+import numpy as np
+
+
+def adjust_pvalues(pvalues: np.ndarray) -> np.ndarray:
+    """Benjamini-Hochberg correction"""
+    pvalues = np.asarray(pvalues, dtype=float)
+    n = len(pvalues)
+    if n == 0:
+        return pvalues
+    order = np.argsort(pvalues)
+    ranked = pvalues[order] * n / np.arange(1, n + 1)
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    adjusted = np.empty(n)
+    adjusted[order] = np.clip(ranked, 0, 1)
+    return adjusted
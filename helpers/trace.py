@@ -0,0 +1,185 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Lightweight tracing of pipeline stages.
+#
+#  Set UTR_TRACE=<file> to record every traced call (wall time, CPU time,
+#  peak RSS and number of records) as one JSON line per call. Lines are
+#  Chrome trace 'complete' events, so the file can be converted and opened
+#  in chrome://tracing or Perfetto:
+#
+#   UTR_TRACE=trace.jsonl python main.py
+#   python -m helpers.trace trace.jsonl --chrome trace.json
+#
+#  Worker processes inherit the variable and append to the same file.
+#  Without UTR_TRACE, traced functions only pay one environment lookup.
+
+import argparse
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_ENV = "UTR_TRACE"
+
+
+def trace_file():
+    """Trace output file or None when tracing is off"""
+    return os.environ.get(TRACE_ENV) or None
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process in MB (0 where unknown)"""
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return 0.0
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    scale = 1 if sys.platform == "darwin" else 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    return round(peak / 2 ** 20, 1)
+
+
+def _emit(filename: str, event: dict):
+    # One write per line keeps lines from different processes intact
+    line = (json.dumps(event, default=str) + "\n").encode()
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def span(name: str, category="stage", **args):
+    """
+    Traces the enclosed block. Yields a dict which can be filled with
+    more details, e.g. span["records"] = len(df).
+
+    :param name: Name of the event
+    :param category: Chrome trace category
+    :param args: Extra details stored with the event
+    """
+    filename = trace_file()
+    info = dict(args)
+    if filename is None:
+        yield info
+        return
+    ts = time.time()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    peak = peak_rss_mb()
+    try:
+        yield info
+    except BaseException as e:
+        info["error"] = type(e).__name__
+        raise
+    finally:
+        info["cpu"] = round(time.process_time() - cpu, 6)
+        info["peak_rss_mb"] = peak_rss_mb()
+        info["rss_growth_mb"] = round(info["peak_rss_mb"] - peak, 1)
+        _emit(filename, {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round(ts * 1e6),
+            "dur": round((time.perf_counter() - wall) * 1e6),
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": info,
+        })
+
+
+def count_records(result):
+    """Default record count: len() of containers, None for anything else"""
+    if isinstance(result, (str, bytes)):
+        return None
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+
+def traced(func=None, *, name=None, count=count_records):
+    """
+    Decorator which records every call of the function (see span)
+
+    :param name: Event name (default: module.function)
+    :param count: Function which returns the number of records from the
+    returned value
+    """
+
+    def _decorate(f):
+        label = name or f"{f.__module__}.{f.__qualname__}"
+
+        @functools.wraps(f)
+        def _wrapper(*args, **kwargs):
+            if trace_file() is None:
+                return f(*args, **kwargs)
+            with span(label, category=f.__module__) as info:
+                result = f(*args, **kwargs)
+                info["records"] = count(result)
+            return result
+
+        return _wrapper
+
+    if func is not None:
+        return _decorate(func)
+    return _decorate
+
+
+def read_trace(filename: str) -> list:
+    events = []
+    with open(filename) as f:
+        for line in f:
+            if line.strip():
+                events.append(json.loads(line))
+    return events
+
+
+def summarize(events: list) -> list:
+    """
+    Totals per event name, sorted by total wall time
+
+    :return: list of (name, calls, wall s, cpu s, records, max peak RSS)
+    """
+    totals = {}
+    for e in events:
+        t = totals.setdefault(e["name"], [0, 0.0, 0.0, 0, 0.0])
+        t[0] += 1
+        t[1] += e["dur"] / 1e6
+        t[2] += e["args"].get("cpu", 0)
+        t[3] += e["args"].get("records") or 0
+        t[4] = max(t[4], e["args"].get("peak_rss_mb", 0))
+    rows = [(k, *v) for k, v in totals.items()]
+    return sorted(rows, key=lambda x: x[2], reverse=True)
+
+
+def to_chrome_trace(events: list, output: str):
+    with open(output, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Summary of a UTR_TRACE file")
+    parser.add_argument("trace", help="JSON lines written with UTR_TRACE")
+    parser.add_argument("--chrome", help="Also write Chrome trace JSON")
+    args = parser.parse_args()
+    events = read_trace(args.trace)
+    print(f"{'name':<52} {'calls':>6} {'wall s':>9} {'cpu s':>9} "
+          f"{'records':>9} {'peak MB':>8}")
+    for name, calls, wall, cpu, records, peak in summarize(events):
+        print(f"{name[-52:]:<52} {calls:>6} {wall:>9.3f} {cpu:>9.3f} "
+              f"{records:>9} {peak:>8}")
+    if args.chrome is not None:
+        to_chrome_trace(events, args.chrome)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  Precomputed per-gene UTR table (longest transcript for each gene)
+
+import os
+
+import numpy as np
+
+from helpers.cache import atomic_write
+from helpers.constants import *
+from helpers.trace import traced
+
+TABLE_COLUMNS = ["gene_id", "gene_name", "transcript", "length", "gc"]
+
+
+def table_filename(utr: int) -> str:
+    return f"data/utr{utr}_table_e{ENSEMBL_RELEASE}.npz"
+
+
+class UTRTable:
+    """
+    Columnar table with one row per gene (longest transcript with an
+    available UTR). Rows are sorted by gene ID so that any gene list can
+    be joined with a single searchsorted.
+    """
+
+    def __init__(self, gene_id, gene_name, transcript, length, gc):
+        self.gene_id = gene_id
+        self.gene_name = gene_name
+        self.transcript = transcript
+        self.length = length
+        self.gc = gc
+
+    def __len__(self):
+        return len(self.gene_id)
+
+    def locate(self, genes) -> np.ndarray:
+        """
+        :param genes: Array of gene IDs (e.g. from get_genes)
+        :return: Row positions of the genes present in the table
+        """
+        genes = np.asarray(genes, dtype=self.gene_id.dtype)
+        if len(self) == 0 or len(genes) == 0:
+            return np.zeros(0, dtype=np.intp)
+        pos = np.searchsorted(self.gene_id, genes)
+        pos[pos == len(self)] = 0
+        return np.unique(pos[self.gene_id[pos] == genes])
+
+    def lookup(self, genes) -> np.ndarray:
+        """
+        UTR length of every given gene in the same order (-1 if the gene
+        is not in the table)
+        """
+        genes = np.asarray(genes, dtype=self.gene_id.dtype)
+        result = np.full(len(genes), -1, dtype=np.int64)
+        if len(self) == 0 or len(genes) == 0:
+            return result
+        pos = np.searchsorted(self.gene_id, genes)
+        pos[pos == len(self)] = 0
+        found = self.gene_id[pos] == genes
+        result[found] = self.length[pos[found]]
+        return result
+
+    def lengths(self, genes) -> np.ndarray:
+        return self.length[self.locate(genes)]
+
+    def gc_content(self, genes) -> np.ndarray:
+        return self.gc[self.locate(genes)]
+
+    def save(self, filename: str):
+        with atomic_write(filename) as tmp:
+            np.savez(tmp, **{k: getattr(self, k) for k in TABLE_COLUMNS})
+
+    @classmethod
+    def load(cls, filename: str):
+        with np.load(filename, allow_pickle=False) as data:
+            return cls(*[data[k] for k in TABLE_COLUMNS])
+
+
+@traced
+def build_utr_table(ctx, utr: int) -> UTRTable:
+    """
+    Builds the table from the annotation context. Every chosen sequence is
+    read exactly once to compute its GC content.
+
+    :param ctx: UTRContext
+    :param utr: 5 or 3
+    """
+    from helpers.context import COL_NAME, COL_TRANSCRIPT
+
+    index = ctx.utr(utr)
+    df = ctx.longest(utr).sort_index()
+    transcripts = df[COL_TRANSCRIPT].to_numpy(dtype=str)
+    length = np.asarray([index.length(x) for x in transcripts],
+                        dtype=np.int64)
+    gc = np.zeros(len(transcripts), dtype=np.float32)
+    for i, t in enumerate(transcripts):
+        if length[i] > 0:
+            s = index.sequence(t).upper()
+            gc[i] = (s.count("G") + s.count("C")) / length[i]
+    return UTRTable(df.index.to_numpy(dtype=str),
+                    df[COL_NAME].fillna("").to_numpy(dtype=str),
+                    transcripts, length, gc)
+
+
+def load_utr_table(ctx, utr: int) -> UTRTable:
+    """
+    Loads the table saved for current Ensembl release. It is rebuilt when
+    missing or older than any of its source files.
+    """
+    filename = table_filename(utr)
+    source = FILE_5UTR if utr == 5 else FILE_3UTR
+    if (os.path.isfile(filename) and
+            os.path.getmtime(filename) >= max(os.path.getmtime(source),
+                                              os.path.getmtime(FILE_MAPPING))):
+        return UTRTable.load(filename)
+    table = build_utr_table(ctx, utr)
+    table.save(filename)
+    return table
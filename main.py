@@ -7,8 +7,54 @@
 #  are downloaded from the  ENSEMBL's BioMart portal on 20 Oct 2020.
 #  https://www.ensembl.org/biomart
 #  Ensembl Genes 101 > Zebrafish Genes (GRCz11) > Export
+#
+#  Usage:
+#   python main.py                      # UTR sweep (as before)
+#   python main.py run.toml             # all stages of the config
+#   python main.py run.toml -s pca -n   # show what 'pca' would run
+#   python main.py run.toml --headless  # no display (e.g. cluster nodes)
+#   python main.py --trace trace.jsonl  # per-stage timings (helpers.trace)
+
+import argparse
+import os
+
+from helpers.pipeline import load_config, run_pipeline
+from helpers.plotting import HEADLESS_ENV
+from helpers.trace import TRACE_ENV
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="UTR analysis pipeline")
+    parser.add_argument("config", nargs="?",
+                        help="TOML / YAML file describing the stages")
+    parser.add_argument("-s", "--stage", action="append",
+                        help="Run only this stage (and its dependencies). "
+                             "Can be given multiple times.")
+    parser.add_argument("-w", "--workers", type=int,
+                        help="Number of stages running at the same time")
+    parser.add_argument("-n", "--dry-run", action="store_true",
+                        help="Only print the stages in execution order")
+    parser.add_argument("--headless", action="store_true",
+                        help="Use the non-interactive Agg backend for all "
+                             f"plots (same as {HEADLESS_ENV}=1)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="Record timing of traced functions (same as "
+                             f"{TRACE_ENV}=FILE)")
+    args = parser.parse_args()
+    # Set before anything imports matplotlib; inherited by workers
+    if args.headless:
+        os.environ[HEADLESS_ENV] = "1"
+    if args.trace:
+        os.environ[TRACE_ENV] = os.path.abspath(args.trace)
 
+    if args.config is None:
+        from analysis.utr import run
+        run()
+        return
+    run_pipeline(load_config(args.config), workers=args.workers,
+                 only=args.stage, dry_run=args.dry_run)
 
-from analysis.utr import run
 
-run()
+if __name__ == "__main__":
+    main()
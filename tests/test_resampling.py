@@ -0,0 +1,33 @@
+#  Copyright (c) 2020.
+#  Author: Rohit Suratekar, IIMCB
+#
+#  UTR Analysis and related statistics
+#
+#  KS statistic of the resampling tests on tied values
+
+import numpy as np
+from scipy.stats import ks_2samp
+
+from analysis.resampling import background_test, permutation_test
+
+
+def test_ks_matches_scipy_with_ties():
+    rng = np.random.default_rng(0)
+    a = rng.integers(0, 5, 200)
+    b = rng.integers(0, 5, 300)
+    result = permutation_test(a, b, n=2000)
+    assert np.isclose(result["ks"], ks_2samp(a, b).statistic)
+    assert result["p_ks"] > 0.5
+
+
+def test_ks_identical_samples():
+    assert permutation_test([1, 1, 1], [1, 1, 1], n=100)["ks"] == 0
+
+
+def test_background_ks_matches_scipy_with_ties():
+    rng = np.random.default_rng(1)
+    values = rng.integers(0, 5, 500)
+    selected = np.arange(200)
+    result = background_test(values, selected, n=500)
+    expected = ks_2samp(values[selected], values[200:]).statistic
+    assert np.isclose(result["ks"], expected)